@@ -2,7 +2,7 @@
 Agent management API routes for NETVEXA platform.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Path, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_
 from typing import List, Optional
@@ -12,7 +12,7 @@ import logging
 
 from database import async_session, Agent, User, Conversation, KnowledgeDocument
 from auth import get_current_user, get_current_user_or_api_key
-from models import AgentConfig
+from models import AgentConfig, UUID_PATTERN
 from metrics import metrics_tracker
 
 logger = logging.getLogger(__name__)
@@ -20,6 +20,14 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/agents", tags=["agents"])
 
 
+async def invalidate_prompt_prefix(agent_id: str):
+    """Drop the RAG engine's cached system prompt for an agent"""
+    from rag import get_rag_engine
+    prefix_cache = get_rag_engine().prefix_cache
+    if prefix_cache:
+        await prefix_cache.invalidate(agent_id)
+
+
 class AgentCreate(BaseModel):
     name: str
     personality: Optional[dict] = {
@@ -147,7 +155,7 @@ async def list_agents(
 
 @router.get("/{agent_id}", response_model=AgentResponse)
 async def get_agent(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Get a specific agent by ID."""
@@ -191,8 +199,8 @@ async def get_agent(
 
 @router.put("/{agent_id}", response_model=AgentResponse)
 async def update_agent(
-    agent_id: str,
     agent_data: AgentUpdate,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Update an agent."""
@@ -228,6 +236,9 @@ async def update_agent(
         await session.commit()
         await session.refresh(agent)
         
+        # The cached system prompt was rendered from the old config
+        await invalidate_prompt_prefix(agent_id)
+        
         # Track agent update
         await metrics_tracker.track_event("agent_updated", {
             "user_id": user.id,
@@ -245,7 +256,7 @@ async def update_agent(
 
 @router.delete("/{agent_id}")
 async def delete_agent(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Delete an agent and all associated data."""
@@ -277,6 +288,11 @@ async def delete_agent(
         await session.delete(agent)
         await session.commit()
         
+        # Drop cached ownership used by the knowledge routes
+        from knowledge_routes import invalidate_agent_owner
+        invalidate_agent_owner(agent_id)
+        await invalidate_prompt_prefix(agent_id)
+        
         # Track agent deletion
         await metrics_tracker.track_event("agent_deleted", {
             "user_id": user.id,
@@ -287,7 +303,7 @@ async def delete_agent(
 
 
 @router.get("/{agent_id}/config")
-async def get_agent_config(agent_id: str):
+async def get_agent_config(agent_id: str = Path(pattern=UUID_PATTERN)):
     """Get agent configuration (public endpoint for chat widget)."""
     async with async_session() as session:
         result = await session.execute(
@@ -322,7 +338,7 @@ async def get_agent_config(agent_id: str):
 
 @router.get("/{agent_id}/documents")
 async def get_agent_documents(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Get all documents for an agent"""
@@ -365,7 +381,7 @@ async def get_agent_documents(
 
 @router.get("/{agent_id}/conversations")
 async def get_agent_conversations(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Get all conversations for an agent"""
@@ -428,8 +444,8 @@ async def get_agent_conversations(
 
 @router.post("/{agent_id}/test-message")
 async def test_agent_message(
-    agent_id: str,
     message: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Test an agent with a sample message."""
@@ -451,8 +467,8 @@ async def test_agent_message(
             )
     
     # Import RAG engine here to avoid circular import
-    from rag.production_rag_engine import ProductionRAGEngine
-    rag_engine = ProductionRAGEngine()
+    from rag import get_rag_engine
+    rag_engine = get_rag_engine()
     
     # Process the test message
     try:
@@ -2,7 +2,7 @@
 Authentication API routes for NETVEXA platform.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Path, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -10,6 +10,7 @@ from datetime import datetime, timedelta
 import logging
 
 from database import async_session, User, ApiKey, get_session
+from models import UUID_PATTERN
 from auth import (
     Token, UserCreate, UserLogin, UserResponse, PasswordReset, PasswordResetConfirm,
     get_password_hash, authenticate_user, create_access_token, create_refresh_token,
@@ -258,7 +259,7 @@ async def list_api_keys(current_user: User = Depends(get_current_user)):
 
 @router.delete("/api-keys/{key_id}")
 async def delete_api_key(
-    key_id: str,
+    key_id: str = Path(pattern=UUID_PATTERN),
     current_user: User = Depends(get_current_user)
 ):
     """Delete (deactivate) an API key."""
@@ -9,7 +9,7 @@ import time
 from typing import Callable
 from jose import jwt
 
-from database import get_db
+from database import async_session
 from billing_service import BillingService
 
 logger = logging.getLogger(__name__)
@@ -71,7 +71,7 @@ async def billing_middleware(request: Request, call_next: Callable):
         endpoint_pattern = get_endpoint_pattern(request.url.path)
         if endpoint_pattern in LIMIT_CHECK_ENDPOINTS:
             usage_type = LIMIT_CHECK_ENDPOINTS[endpoint_pattern]
-            async for db in get_db():
+            async with async_session() as db:
                 allowed = await BillingService.check_usage_limits(
                     user["id"], usage_type, db
                 )
@@ -82,7 +82,6 @@ async def billing_middleware(request: Request, call_next: Callable):
                             "detail": f"Usage limit exceeded for {usage_type}. Please upgrade your subscription."
                         }
                     )
-                break
         
         # Process request
         start_time = time.time()
@@ -91,7 +90,7 @@ async def billing_middleware(request: Request, call_next: Callable):
         
         # Track usage for billable endpoints
         if endpoint_pattern in BILLABLE_ENDPOINTS and response.status_code < 400:
-            async for db in get_db():
+            async with async_session() as db:
                 await BillingService.track_usage(
                     user["id"], "api_call", db, 1
                 )
@@ -101,7 +100,6 @@ async def billing_middleware(request: Request, call_next: Callable):
                     await BillingService.track_usage(
                         user["id"], "message", db, 1
                     )
-                break
         
         # Add process time header
         response.headers["X-Process-Time"] = str(process_time)
@@ -1,7 +1,7 @@
 """
 Billing and subscription models for NETVEXA
 """
-from sqlalchemy import Column, String, Integer, Float, DateTime, Boolean, ForeignKey, JSON, Enum
+from sqlalchemy import Column, String, Integer, Float, DateTime, Boolean, ForeignKey, JSON, Enum, Uuid
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -31,7 +31,7 @@ class Subscription(Base):
     __tablename__ = "subscriptions"
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Uuid(as_uuid=False), ForeignKey("users.id"), nullable=False)
     stripe_customer_id = Column(String, unique=True, index=True)
     stripe_subscription_id = Column(String, unique=True, index=True)
     
@@ -64,7 +64,7 @@ class UsageRecord(Base):
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     subscription_id = Column(String, ForeignKey("subscriptions.id"), nullable=False)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Uuid(as_uuid=False), ForeignKey("users.id"), nullable=False)
     
     # Usage tracking
     period_start = Column(DateTime(timezone=True), nullable=False)
@@ -93,7 +93,7 @@ class Payment(Base):
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     subscription_id = Column(String, ForeignKey("subscriptions.id"), nullable=False)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Uuid(as_uuid=False), ForeignKey("users.id"), nullable=False)
     
     # Stripe payment details
     stripe_payment_intent_id = Column(String, unique=True, index=True)
@@ -6,7 +6,7 @@ import stripe
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, update, and_, or_
 import logging
 
 from billing_models import (
@@ -418,6 +418,44 @@ class BillingService:
             logger.error(f"Error checking usage limits: {e}")
             return False  # Deny on error
     
+    @staticmethod
+    async def consume_message_quota(user_id: str, db: AsyncSession) -> bool:
+        """Count one message against the user's monthly quota, or return False if it is used up"""
+        try:
+            now = datetime.utcnow()
+            period_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            
+            # Check and increment in one statement; the row lock makes it safe under concurrency
+            result = await db.execute(
+                update(UsageRecord)
+                .where(
+                    UsageRecord.user_id == user_id,
+                    UsageRecord.period_start == period_start,
+                    UsageRecord.subscription_id == Subscription.id,
+                    or_(
+                        Subscription.tier == SubscriptionTier.BUSINESS,
+                        UsageRecord.messages_sent < Subscription.message_limit
+                    )
+                )
+                .values(messages_sent=UsageRecord.messages_sent + 1)
+                .returning(UsageRecord.messages_sent)
+                .execution_options(synchronize_session=False)
+            )
+            if result.first() is not None:
+                await db.commit()
+                return True
+            await db.rollback()
+            
+            # No row: either the quota is used up or this is the period's first message
+            if not await BillingService.check_usage_limits(user_id, "message", db):
+                return False
+            await BillingService.track_usage(user_id, "message", db, 1)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error consuming message quota: {e}")
+            return False  # Deny on error
+    
     @staticmethod
     async def get_usage_stats(user_id: str, db: AsyncSession) -> Dict[str, Any]:
         """Get usage statistics for a user"""
@@ -0,0 +1,90 @@
+"""
+Buffered bulk writer for chat messages.
+Collects Message rows off the request path and writes them in multi-row INSERTs.
+"""
+
+import asyncio
+from typing import Any, Dict, List
+import logging
+
+from sqlalchemy import insert
+
+from database import async_session, Message
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 200
+MAX_DELAY = 0.02  # seconds
+SHARDS = 4  # keep at or below half the DB pool size
+
+
+class AsyncBulkWriter:
+    """Buffers Message rows and flushes them every MAX_BATCH rows or MAX_DELAY seconds.
+
+    Rows are sharded by conversation so each shard flushes on its own pooled
+    connection in parallel while a conversation's messages keep their order.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY, shards: int = SHARDS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(shards)]
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Start one background flush loop per shard"""
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self.queues]
+        logger.info(f"Message bulk writer started with {len(self._tasks)} shards")
+
+    async def enqueue(self, row: Dict[str, Any]):
+        """Queue a message row (conversation_id, sender, content, timestamp) for insertion"""
+        shard = hash(row["conversation_id"]) % len(self.queues)
+        await self.queues[shard].put(row)
+
+    async def stop(self):
+        """Stop the flush loops after draining everything already queued"""
+        if not self._tasks:
+            return
+
+        await asyncio.gather(*(queue.join() for queue in self.queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Message bulk writer stopped")
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first row, then gather more until the batch or deadline fills
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} messages: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        async with async_session() as session:
+            await session.execute(insert(Message), batch)
+            await session.commit()
+
+
+# Global bulk writer instance
+bulk_writer = AsyncBulkWriter()
@@ -3,8 +3,20 @@ Business Content Templates
 Pre-built templates for common business scenarios and use cases
 """
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 from enum import Enum
+import hashlib
+import json
+import logging
+import re
+
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    HYPERSCAN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
 
 class BusinessScenario(Enum):
     """Common business scenarios for rich content generation"""
@@ -17,6 +29,9 @@ class BusinessScenario(Enum):
     CASE_STUDY = "case_study"
     COMPETITIVE_ANALYSIS = "competitive_analysis"
 
+# Templates are static, so their JSON encoding and ETag never change
+_TEMPLATE_JSON: Dict[BusinessScenario, Tuple[bytes, str]] = {}
+
 class BusinessTemplates:
     """Business content templates for different scenarios"""
     
@@ -375,58 +390,101 @@ class BusinessTemplates:
     @staticmethod
     def get_template_by_scenario(scenario: BusinessScenario) -> Dict[str, Any]:
         """Get template by business scenario"""
-        template_map = {
-            BusinessScenario.ONBOARDING: BusinessTemplates.get_onboarding_flow(),
-            BusinessScenario.FEATURE_COMPARISON: BusinessTemplates.get_feature_comparison(),
-            BusinessScenario.TESTIMONIALS: BusinessTemplates.get_testimonials(),
-            BusinessScenario.INTEGRATION_GUIDE: BusinessTemplates.get_integration_guide(),
-            BusinessScenario.TROUBLESHOOTING: BusinessTemplates.get_troubleshooting_guide(),
-            BusinessScenario.ROI_CALCULATOR: BusinessTemplates.get_roi_calculator(),
-            BusinessScenario.COMPETITIVE_ANALYSIS: BusinessTemplates.get_competitive_analysis()
-        }
+        template_factory = _TEMPLATE_DISPATCH.get(scenario)
+        if template_factory is None:
+            return {
+                "type": "rich_message",
+                "version": "1.0",
+                "content": [{"type": "text", "text": "Template not found for this scenario."}]
+            }
         
-        return template_map.get(scenario, {
-            "type": "rich_message",
-            "version": "1.0",
-            "content": [{"type": "text", "text": "Template not found for this scenario."}]
-        })
+        # Only build the requested template
+        return template_factory()
+    
+    @staticmethod
+    def get_template_json(scenario: BusinessScenario) -> Tuple[bytes, str]:
+        """Get serialized template body and its ETag, computed once per scenario"""
+        cached = _TEMPLATE_JSON.get(scenario)
+        if cached is None:
+            body = json.dumps(
+                BusinessTemplates.get_template_by_scenario(scenario),
+                ensure_ascii=False,
+                separators=(",", ":")
+            ).encode("utf-8")
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            cached = _TEMPLATE_JSON[scenario] = (body, etag)
+        return cached
     
     @staticmethod
     def detect_scenario_from_message(message: str) -> BusinessScenario:
         """Detect business scenario from user message"""
-        message_lower = message.lower()
-        
-        # Onboarding indicators
-        if any(word in message_lower for word in ["setup", "get started", "onboard", "begin", "how to start"]):
-            return BusinessScenario.ONBOARDING
-        
-        # Feature comparison indicators  
-        if any(word in message_lower for word in ["compare", "vs", "versus", "difference", "which plan"]):
-            return BusinessScenario.FEATURE_COMPARISON
+        if _SCENARIO_DB is not None:
+            # Pattern ids follow _SCENARIO_KEYWORDS order, so the lowest id wins
+            matches = []
+            _SCENARIO_DB.scan(
+                message.encode("utf-8"),
+                match_event_handler=lambda pattern_id, start, end, flags, context: matches.append(pattern_id)
+            )
+            if matches:
+                return _SCENARIO_KEYWORDS[min(matches)][0]
+            return BusinessScenario.ONBOARDING  # Default fallback
         
-        # Testimonials/social proof indicators
-        if any(word in message_lower for word in ["testimonial", "review", "customer", "success", "case study"]):
-            return BusinessScenario.TESTIMONIALS
-        
-        # Integration indicators
-        if any(word in message_lower for word in ["integrate", "connect", "api", "webhook", "zapier", "slack"]):
-            return BusinessScenario.INTEGRATION_GUIDE
-        
-        # Troubleshooting indicators
-        if any(word in message_lower for word in ["problem", "issue", "error", "not working", "troubleshoot", "help"]):
-            return BusinessScenario.TROUBLESHOOTING
-        
-        # ROI/business value indicators
-        if any(word in message_lower for word in ["roi", "return", "investment", "save", "cost", "value", "business case"]):
-            return BusinessScenario.ROI_CALCULATOR
+        message_lower = message.lower()
         
-        # Competitive analysis indicators
-        if any(word in message_lower for word in ["competitor", "alternative", "better than", "switch from"]):
-            return BusinessScenario.COMPETITIVE_ANALYSIS
+        for scenario, keywords in _SCENARIO_KEYWORDS:
+            if any(word in message_lower for word in keywords):
+                return scenario
         
         return BusinessScenario.ONBOARDING  # Default fallback
 
 
+_TEMPLATE_DISPATCH = {
+    BusinessScenario.ONBOARDING: BusinessTemplates.get_onboarding_flow,
+    BusinessScenario.FEATURE_COMPARISON: BusinessTemplates.get_feature_comparison,
+    BusinessScenario.TESTIMONIALS: BusinessTemplates.get_testimonials,
+    BusinessScenario.INTEGRATION_GUIDE: BusinessTemplates.get_integration_guide,
+    BusinessScenario.TROUBLESHOOTING: BusinessTemplates.get_troubleshooting_guide,
+    BusinessScenario.ROI_CALCULATOR: BusinessTemplates.get_roi_calculator,
+    BusinessScenario.COMPETITIVE_ANALYSIS: BusinessTemplates.get_competitive_analysis
+}
+
+
+# Keyword indicators per scenario, in detection priority order
+_SCENARIO_KEYWORDS = [
+    (BusinessScenario.ONBOARDING, ["setup", "get started", "onboard", "begin", "how to start"]),
+    (BusinessScenario.FEATURE_COMPARISON, ["compare", "vs", "versus", "difference", "which plan"]),
+    (BusinessScenario.TESTIMONIALS, ["testimonial", "review", "customer", "success", "case study"]),
+    (BusinessScenario.INTEGRATION_GUIDE, ["integrate", "connect", "api", "webhook", "zapier", "slack"]),
+    (BusinessScenario.TROUBLESHOOTING, ["problem", "issue", "error", "not working", "troubleshoot", "help"]),
+    (BusinessScenario.ROI_CALCULATOR, ["roi", "return", "investment", "save", "cost", "value", "business case"]),
+    (BusinessScenario.COMPETITIVE_ANALYSIS, ["competitor", "alternative", "better than", "switch from"]),
+]
+
+def _compile_scenario_database():
+    """Compile scenario keywords into a single Hyperscan block-mode database"""
+    expressions = []
+    ids = []
+    for scenario_index, (_, keywords) in enumerate(_SCENARIO_KEYWORDS):
+        for word in keywords:
+            expressions.append(re.escape(word).encode("utf-8"))
+            ids.append(scenario_index)
+    
+    try:
+        db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        db.compile(
+            expressions=expressions,
+            ids=ids,
+            elements=len(expressions),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(expressions)
+        )
+        return db
+    except Exception as e:
+        logger.warning(f"Failed to compile Hyperscan scenario database, using substring scan: {e}")
+        return None
+
+_SCENARIO_DB = _compile_scenario_database() if HYPERSCAN_AVAILABLE else None
+
+
 # Usage example
 if __name__ == "__main__":
     import json
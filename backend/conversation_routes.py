@@ -2,14 +2,15 @@
 Conversation management API routes for NETVEXA platform.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Path, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, lambda_stmt
 from typing import List
-from pydantic import BaseModel
+from dataclasses import dataclass
 import logging
 
 from database import async_session, Conversation, Message, Agent
+from models import UUID_PATTERN
 from auth import get_current_user_or_api_key
 
 logger = logging.getLogger(__name__)
@@ -17,7 +18,8 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/conversations", tags=["conversations"])
 
 
-class MessageResponse(BaseModel):
+@dataclass(slots=True)
+class MessageResponse:
     id: int
     conversation_id: str
     sender: str
@@ -25,9 +27,32 @@ class MessageResponse(BaseModel):
     timestamp: str
 
 
+def _owned_conversation_stmt(conversation_id: str, user_id: str):
+    """Conversation lookup scoped to the owning user, cached as a lambda statement"""
+    return lambda_stmt(
+        lambda: select(Conversation)
+        .join(Agent, Conversation.agent_id == Agent.id)
+        .where(
+            and_(
+                Conversation.id == conversation_id,
+                Agent.user_id == user_id
+            )
+        )
+    )
+
+
+def _conversation_messages_stmt(conversation_id: str):
+    """Messages of a conversation in order, cached as a lambda statement"""
+    return lambda_stmt(
+        lambda: select(Message)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.timestamp)
+    )
+
+
 @router.get("/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_conversation_messages(
-    conversation_id: str,
+    conversation_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Get all messages for a conversation."""
@@ -36,14 +61,7 @@ async def get_conversation_messages(
     async with async_session() as session:
         # Verify conversation exists and user has access
         result = await session.execute(
-            select(Conversation)
-            .join(Agent, Conversation.agent_id == Agent.id)
-            .where(
-                and_(
-                    Conversation.id == conversation_id,
-                    Agent.user_id == user.id
-                )
-            )
+            _owned_conversation_stmt(conversation_id, user.id)
         )
         conversation = result.scalar_one_or_none()
         
@@ -55,9 +73,7 @@ async def get_conversation_messages(
         
         # Get messages
         result = await session.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation_id)
-            .order_by(Message.timestamp)
+            _conversation_messages_stmt(conversation_id)
         )
         messages = result.scalars().all()
         
@@ -75,7 +91,7 @@ async def get_conversation_messages(
 
 @router.get("/{conversation_id}", response_model=dict)
 async def get_conversation_detail(
-    conversation_id: str,
+    conversation_id: str = Path(pattern=UUID_PATTERN),
     auth_info: dict = Depends(get_current_user_or_api_key)
 ):
     """Get conversation details with messages."""
@@ -84,14 +100,7 @@ async def get_conversation_detail(
     async with async_session() as session:
         # Verify conversation exists and user has access
         result = await session.execute(
-            select(Conversation)
-            .join(Agent, Conversation.agent_id == Agent.id)
-            .where(
-                and_(
-                    Conversation.id == conversation_id,
-                    Agent.user_id == user.id
-                )
-            )
+            _owned_conversation_stmt(conversation_id, user.id)
         )
         conversation = result.scalar_one_or_none()
         
@@ -103,9 +112,7 @@ async def get_conversation_detail(
         
         # Get messages
         result = await session.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation_id)
-            .order_by(Message.timestamp)
+            _conversation_messages_stmt(conversation_id)
         )
         messages = result.scalars().all()
         
@@ -4,10 +4,12 @@ Script to create test conversations for development/testing
 """
 
 import asyncio
+import orjson
 import sys
+import uuid
 from datetime import datetime, timedelta
 from database import init_db, async_session, Agent, Conversation, Message, User
-from sqlalchemy import select
+from sqlalchemy import select, insert
 
 async def create_test_conversations():
     """Create test conversations for the first agent found"""
@@ -78,33 +80,58 @@ async def create_test_conversations():
             }
         ]
         
+        # Pre-generate conversation IDs so messages can reference them without a flush
+        conv_rows = []
+        msg_rows = []
         for i, conv_data in enumerate(conversations_data):
             # Create conversation with staggered timestamps
             start_time = datetime.utcnow() - timedelta(days=i+1, hours=i*2)
+            conv_id = str(uuid.uuid4())
             
-            conversation = Conversation(
-                agent_id=agent.id,
-                visitor_id=conv_data["visitor_id"],
-                started_at=start_time,
-                ended_at=start_time + timedelta(minutes=len(conv_data["messages"]) * 2),
-                meta_data={"source": "test_data", "test_user": True}
-            )
-            session.add(conversation)
-            await session.flush()  # Get the conversation ID
+            conv_rows.append({
+                "id": conv_id,
+                "agent_id": agent.id,
+                "visitor_id": conv_data["visitor_id"],
+                "lead_id": None,
+                "started_at": start_time,
+                "ended_at": start_time + timedelta(minutes=len(conv_data["messages"]) * 2),
+                "source": "test_data",
+                "test_user": True,
+                "meta_data": {}
+            })
             
             # Add messages
             for j, (sender, content) in enumerate(conv_data["messages"]):
                 message_time = start_time + timedelta(minutes=j*2)
-                message = Message(
-                    conversation_id=conversation.id,
-                    sender=sender,
-                    content=content,
-                    timestamp=message_time
-                )
-                session.add(message)
+                msg_rows.append({
+                    "conversation_id": conv_id,
+                    "sender": sender,
+                    "content": content,
+                    "timestamp": message_time,
+                    "meta_data": {}
+                })
             
             print(f"Created conversation {i+1} with {len(conv_data['messages'])} messages")
         
+        conn = await session.connection()
+        if conn.dialect.driver == "asyncpg":
+            # Bulk load both tables over asyncpg's COPY protocol
+            raw = (await conn.get_raw_connection()).driver_connection
+            for table, rows in (("conversations", conv_rows), ("messages", msg_rows)):
+                columns = list(rows[0])
+                await raw.copy_records_to_table(
+                    table,
+                    records=[
+                        tuple(orjson.dumps(row[c]).decode() if c == "meta_data" else row[c] for c in columns)
+                        for row in rows
+                    ],
+                    columns=columns
+                )
+        else:
+            # Core executemany bypasses the ORM unit of work on other drivers
+            await session.execute(insert(Conversation), conv_rows)
+            await session.execute(insert(Message), msg_rows)
+        
         await session.commit()
         print(f"\n✅ Successfully created {len(conversations_data)} test conversations!")
         print(f"Agent: {agent.name} (ID: {agent.id})")
@@ -1,22 +1,39 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from sqlalchemy import Column, String, DateTime, JSON, Float, Integer, Text, ARRAY, Boolean, ForeignKey
-from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column, String, DateTime, JSON, Float, Integer, Text, ARRAY, Boolean, ForeignKey, Index, Uuid, DDL, event
+from sqlalchemy.engine import make_url
+from pgvector.sqlalchemy import HALFVEC
 from datetime import datetime
 import uuid
+import sys
 import logging
+import orjson
 
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Larger prepared-statement caches so hot queries skip parsing and planning
+# on pooled connections (asyncpg only; both caches default to 100)
+_connect_args = {}
+if make_url(settings.DATABASE_URL).get_driver_name() == "asyncpg":
+    _connect_args = {"statement_cache_size": 1024, "prepared_statement_cache_size": 1024}
+
 # Create async engine with PostgreSQL
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=False,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=1800,
+    connect_args=_connect_args,
+    # Batch ORM multi-row INSERTs into larger multi-VALUES statements;
+    # bigger pages mean fewer round-trips at the cost of larger statements
+    insertmanyvalues_page_size=1000,
+    # JSON columns are encoded/decoded with orjson instead of stdlib json
+    json_serializer=lambda value: orjson.dumps(value).decode(),
+    json_deserializer=orjson.loads
 )
 
 # Create async session factory
@@ -31,7 +48,7 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(Uuid(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
     email = Column(String, unique=True, nullable=False, index=True)
     hashed_password = Column(String, nullable=False)
     company_name = Column(String, nullable=False)
@@ -50,8 +67,8 @@ class User(Base):
 class ApiKey(Base):
     __tablename__ = "api_keys"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(Uuid(as_uuid=False), ForeignKey("users.id"), nullable=False)
     name = Column(String, nullable=False)
     key = Column(String, unique=True, nullable=False, index=True)
     is_active = Column(Boolean, default=True)
@@ -65,8 +82,8 @@ class ApiKey(Base):
 class Agent(Base):
     __tablename__ = "agents"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(Uuid(as_uuid=False), ForeignKey("users.id"), nullable=False)
     name = Column(String, nullable=False)
     config = Column(JSON, default={})
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -79,14 +96,21 @@ class Agent(Base):
 class Conversation(Base):
     __tablename__ = "conversations"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    agent_id = Column(Uuid(as_uuid=False), ForeignKey("agents.id"), nullable=False)
     visitor_id = Column(String, nullable=True)
-    lead_id = Column(String, nullable=True)
+    lead_id = Column(Uuid(as_uuid=False), nullable=True)  # no FK: leads already reference conversations
     started_at = Column(DateTime, default=datetime.utcnow)
     ended_at = Column(DateTime, nullable=True)
+    source = Column(String, nullable=True)  # websocket, test_data, ...
+    test_user = Column(Boolean, default=False)
     meta_data = Column(JSON, default={})  # Renamed from metadata to avoid conflict
     
+    __table_args__ = (
+        # Per-agent conversation lists ordered by start time
+        Index("ix_conversations_agent_started", "agent_id", "started_at"),
+    )
+    
     # Relationships
     agent = relationship("Agent", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
@@ -95,25 +119,49 @@ class Message(Base):
     __tablename__ = "messages"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
+    conversation_id = Column(Uuid(as_uuid=False), ForeignKey("conversations.id"), nullable=False)
     sender = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     meta_data = Column(JSON, default={})  # Renamed from metadata to avoid conflict
     
+    __table_args__ = (
+        # Conversation transcripts ordered by timestamp
+        Index("ix_messages_conv_ts", "conversation_id", "timestamp"),
+    )
+    
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
 
+@event.listens_for(Message.__table__, "after_create")
+def _compress_message_content(target, connection, **kw):
+    """Long LLM replies get TOASTed; LZ4 (PostgreSQL 14+) compresses them faster than pglz"""
+    dialect = connection.dialect
+    if dialect.name != "postgresql" or (dialect.server_version_info or ()) < (14,):
+        return
+    try:
+        # Savepoint so a server built without lz4 doesn't abort the surrounding create_all
+        with connection.begin_nested():
+            connection.execute(DDL("ALTER TABLE messages ALTER COLUMN content SET COMPRESSION lz4"))
+    except Exception as e:
+        logger.warning(f"Keeping default compression for messages.content: {e}")
+
+@event.listens_for(Message, "load")
+def _intern_message_sender(target, context):
+    """Share one str object per sender value across loaded messages"""
+    if target.sender is not None:
+        target.__dict__["sender"] = sys.intern(target.sender)
+
 class KnowledgeDocument(Base):
     __tablename__ = "knowledge_documents"
     
-    id = Column(String, primary_key=True)
-    agent_id = Column(String, nullable=False)
+    id = Column(String, primary_key=True)  # callers of PgVectorStore may supply their own ids
+    agent_id = Column(Uuid(as_uuid=False), nullable=False)
     title = Column(String, nullable=True)
     content = Column(Text, nullable=False)
     url = Column(String, nullable=True)
     meta_data = Column(JSON, default={})  # Keep original name to avoid SQLAlchemy conflict
-    embedding = Column(Vector())  # Dynamic dimension based on provider
+    embedding = Column(HALFVEC())  # Unit-normalized FP16; dimension follows the provider
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -124,13 +172,13 @@ class KnowledgeDocument(Base):
     def set_metadata(self, value):
         self.meta_data = value
 
+# Register billing and lead tables with Base.metadata once at import.
+# Kept below the model definitions because both modules import Base from here.
+import billing_models  # noqa: E402,F401
+import lead_models  # noqa: E402,F401
+
 async def init_db():
     """Initialize database tables"""
-    # Import billing models to ensure they're registered with SQLAlchemy
-    from billing_models import Subscription, UsageRecord, Payment, PricingPlan
-    # Import lead models
-    from lead_models import Lead, HandoffRequest, LeadForm
-    
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     logger.info("Database initialized successfully")
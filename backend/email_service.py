@@ -2,11 +2,14 @@
 Email service for NETVEXA lead notifications and system emails.
 """
 
+import asyncio
+import queue
 import smtplib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from jinja2 import Template
 
 from config import settings
@@ -14,69 +17,12 @@ from lead_models import Lead, HandoffRequest
 
 logger = logging.getLogger(__name__)
 
+# Blocking SMTP I/O runs here so it never stalls the event loop
+SMTP_POOL_SIZE = 4
+smtp_executor = ThreadPoolExecutor(max_workers=SMTP_POOL_SIZE, thread_name_prefix="smtp")
 
-class EmailService:
-    """Email service for sending notifications"""
-    
-    def __init__(self):
-        self.smtp_host = settings.SMTP_HOST
-        self.smtp_port = settings.SMTP_PORT
-        self.smtp_username = settings.SMTP_USERNAME
-        self.smtp_password = settings.SMTP_PASSWORD
-        self.smtp_use_tls = settings.SMTP_USE_TLS
-        self.from_email = settings.EMAIL_FROM
-        self.from_name = settings.EMAIL_FROM_NAME
-    
-    def _create_smtp_connection(self):
-        """Create SMTP connection"""
-        try:
-            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
-            if self.smtp_use_tls:
-                server.starttls()
-            if self.smtp_username and self.smtp_password:
-                server.login(self.smtp_username, self.smtp_password)
-            return server
-        except Exception as e:
-            logger.error(f"Failed to create SMTP connection: {e}")
-            raise
-    
-    def _send_email(self, to_emails: List[str], subject: str, html_content: str, text_content: Optional[str] = None):
-        """Send email using SMTP"""
-        if not self.smtp_username or not self.smtp_password:
-            logger.warning("SMTP credentials not configured, skipping email send")
-            return False
-        
-        try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = f"{self.from_name} <{self.from_email}>"
-            msg['To'] = ', '.join(to_emails)
-            
-            # Add text version if provided
-            if text_content:
-                text_part = MIMEText(text_content, 'plain')
-                msg.attach(text_part)
-            
-            # Add HTML version
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            with self._create_smtp_connection() as server:
-                server.send_message(msg)
-            
-            logger.info(f"Email sent successfully to {', '.join(to_emails)}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to send email: {e}")
-            return False
-    
-    def send_lead_notification(self, lead: Lead, user_email: str):
-        """Send new lead notification to user"""
-        
-        subject = f"New Lead Captured: {lead.email}"
-        
-        html_template = Template('''
+
+_LEAD_HTML = '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -123,7 +69,7 @@ class EmailService:
                         {% endif %}
                         <p><span class="label">Source:</span><span class="value">{{ lead.source.value.replace('_', ' ').title() }}</span></p>
                         <p><span class="label">Lead Score:</span><span class="value">{{ lead.score }}/100</span></p>
-                        <p><span class="label">Captured:</span><span class="value">{{ lead.created_at.strftime('%Y-%m-%d %H:%M UTC') }}</span></p>
+                        <p><span class="label">Captured:</span><span class="value">{{ created_str }}</span></p>
                     </div>
                     
                     <div class="cta">
@@ -144,36 +90,9 @@ class EmailService:
             </div>
         </body>
         </html>
-        ''')
-        
-        text_content = f'''
-        New Lead Captured!
-        
-        Lead Details:
-        Email: {lead.email}
-        Name: {lead.name or 'Not provided'}
-        Company: {lead.company or 'Not provided'}
-        Phone: {lead.phone or 'Not provided'}
-        Source: {lead.source.value.replace('_', ' ').title()}
-        Lead Score: {lead.score}/100
-        Captured: {lead.created_at.strftime('%Y-%m-%d %H:%M UTC')}
-        
-        View this lead in your dashboard: https://dashboard.netvexa.com/leads
-        
-        Best regards,
-        The NETVEXA Team
         '''
-        
-        html_content = html_template.render(lead=lead)
-        
-        return self._send_email([user_email], subject, html_content, text_content)
-    
-    def send_handoff_notification(self, handoff: HandoffRequest, user_email: str, lead: Lead):
-        """Send human handoff notification to user"""
-        
-        subject = f"Human Handoff Request: {lead.email}"
-        
-        html_template = Template('''
+
+_HANDOFF_HTML = '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -216,7 +135,7 @@ class EmailService:
                         {% if handoff.reason %}
                         <p><span class="label">Reason:</span><span class="value">{{ handoff.reason }}</span></p>
                         {% endif %}
-                        <p><span class="label">Requested:</span><span class="value">{{ handoff.created_at.strftime('%Y-%m-%d %H:%M UTC') }}</span></p>
+                        <p><span class="label">Requested:</span><span class="value">{{ created_str }}</span></p>
                     </div>
                     
                     <div class="handoff-info">
@@ -249,7 +168,259 @@ class EmailService:
             </div>
         </body>
         </html>
-        ''')
+        '''
+
+# Compiled once at import; each send only renders
+LEAD_TEMPLATE = Template(_LEAD_HTML)
+HANDOFF_TEMPLATE = Template(_HANDOFF_HTML)
+
+# Jinja expressions in _LEAD_HTML and the format fields replacing them
+_LEAD_FAST_FIELDS = {
+    "{{ lead.email }}": "email",
+    "{{ lead.name }}": "name",
+    "{{ lead.company }}": "company",
+    "{{ lead.phone }}": "phone",
+    "{{ lead.source.value.replace('_', ' ').title() }}": "source",
+    "{{ lead.score }}": "score",
+    "{{ created_str }}": "created_str",
+}
+
+
+def _build_lead_fast_html() -> str:
+    """_LEAD_HTML with every optional block taken, as a str.format template"""
+    html = _LEAD_HTML
+    for tag in ("{% if lead.name %}", "{% if lead.company %}", "{% if lead.phone %}", "{% endif %}"):
+        html = html.replace(tag, "")
+    html = html.replace("{", "{{").replace("}", "}}")
+    for expression, field in _LEAD_FAST_FIELDS.items():
+        html = html.replace(expression.replace("{", "{{").replace("}", "}}"), "{" + field + "}")
+    return html
+
+
+_LEAD_FAST_HTML = _build_lead_fast_html()
+
+
+def _render_lead_fast(lead: Lead, created_str: str) -> str:
+    """Render the lead email, skipping Jinja when all optional fields are present"""
+    if not (lead.name and lead.company and lead.phone):
+        return LEAD_TEMPLATE.render(lead=lead, created_str=created_str)
+    
+    return _LEAD_FAST_HTML.format(
+        email=lead.email,
+        name=lead.name,
+        company=lead.company,
+        phone=lead.phone,
+        source=lead.source.value.replace('_', ' ').title(),
+        score=lead.score,
+        created_str=created_str
+    )
+
+
+class EmailService:
+    """Email service for sending notifications"""
+    
+    def __init__(self):
+        self.smtp_host = settings.SMTP_HOST
+        self.smtp_port = settings.SMTP_PORT
+        self.smtp_username = settings.SMTP_USERNAME
+        self.smtp_password = settings.SMTP_PASSWORD
+        self.smtp_use_tls = settings.SMTP_USE_TLS
+        self.from_email = settings.EMAIL_FROM
+        self.from_name = settings.EMAIL_FROM_NAME
+        # Idle authenticated connections, shared by the SMTP executor threads
+        self._pool: queue.Queue = queue.Queue(maxsize=SMTP_POOL_SIZE)
+    
+    def _create_smtp_connection(self):
+        """Create SMTP connection"""
+        try:
+            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
+            if self.smtp_use_tls:
+                server.starttls()
+            if self.smtp_username and self.smtp_password:
+                server.login(self.smtp_username, self.smtp_password)
+            return server
+        except Exception as e:
+            logger.error(f"Failed to create SMTP connection: {e}")
+            raise
+    
+    def _acquire_connection(self) -> smtplib.SMTP:
+        """Get a live pooled SMTP connection, or open a new one"""
+        while True:
+            try:
+                server = self._pool.get_nowait()
+            except queue.Empty:
+                return self._create_smtp_connection()
+            
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close_connection(server)
+    
+    def _release_connection(self, server: smtplib.SMTP):
+        """Return a healthy connection to the pool"""
+        try:
+            self._pool.put_nowait(server)
+        except queue.Full:
+            self._close_connection(server)
+    
+    def _close_connection(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+    
+    def _build_message(self, to_emails: List[str], subject: str, html_content: str, text_content: Optional[str] = None) -> MIMEMultipart:
+        """Build a multipart email message"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = f"{self.from_name} <{self.from_email}>"
+        msg['To'] = ', '.join(to_emails)
+        
+        # Add text version if provided
+        if text_content:
+            text_part = MIMEText(text_content, 'plain')
+            msg.attach(text_part)
+        
+        # Add HTML version
+        html_part = MIMEText(html_content, 'html')
+        msg.attach(html_part)
+        
+        return msg
+    
+    def _send_email(self, to_emails: List[str], subject: str, html_content: str, text_content: Optional[str] = None):
+        """Send email using SMTP"""
+        if not self.smtp_username or not self.smtp_password:
+            logger.warning("SMTP credentials not configured, skipping email send")
+            return False
+        
+        try:
+            msg = self._build_message(to_emails, subject, html_content, text_content)
+            
+            server = self._acquire_connection()
+            try:
+                server.send_message(msg)
+            except Exception:
+                # Don't hand a possibly broken connection back to the pool
+                self._close_connection(server)
+                raise
+            self._release_connection(server)
+            
+            logger.info(f"Email sent successfully to {', '.join(to_emails)}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to send email: {e}")
+            return False
+    
+    def _send_email_bulk(self, emails: List[Tuple[List[str], str, str, Optional[str]]]) -> int:
+        """Send several (to_emails, subject, html, text) emails over one SMTP session"""
+        if not self.smtp_username or not self.smtp_password:
+            logger.warning("SMTP credentials not configured, skipping email send")
+            return 0
+        
+        if not emails:
+            return 0
+        
+        messages = [self._build_message(*email) for email in emails]
+        sent = 0
+        failed = 0
+        server = None
+        
+        for index, msg in enumerate(messages):
+            # A dropped session is reopened and the message retried once
+            for attempt in range(2):
+                try:
+                    if server is None:
+                        server = self._acquire_connection()
+                    server.send_message(msg)
+                    sent += 1
+                    break
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    # Refused by the server; the session is still usable for the rest
+                    logger.error(f"Failed to send email to {msg['To']}: {e}")
+                    failed += 1
+                    break
+                except Exception as e:
+                    if server is not None:
+                        self._close_connection(server)
+                        server = None
+                    if attempt:
+                        logger.error(f"Failed to send email to {msg['To']}: {e}")
+                        failed += 1
+            
+            if server is None:
+                # Still no connection after a retry: the server is unreachable, so
+                # report the rest instead of timing out on each of them
+                for pending in messages[index + 1:]:
+                    logger.error(f"Failed to send email to {pending['To']}: no SMTP connection")
+                failed += len(messages) - index - 1
+                break
+        
+        if server is not None:
+            self._release_connection(server)
+        
+        logger.info(f"Sent {sent}/{len(messages)} emails, {failed} failed")
+        return sent
+    
+    def _build_lead_notification(self, lead: Lead) -> Tuple[str, str, str]:
+        """Build subject, HTML and text bodies of a new lead notification"""
+        
+        subject = f"New Lead Captured: {lead.email}"
+        created_str = lead.created_at.strftime('%Y-%m-%d %H:%M UTC')
+        
+        text_content = f'''
+        New Lead Captured!
+        
+        Lead Details:
+        Email: {lead.email}
+        Name: {lead.name or 'Not provided'}
+        Company: {lead.company or 'Not provided'}
+        Phone: {lead.phone or 'Not provided'}
+        Source: {lead.source.value.replace('_', ' ').title()}
+        Lead Score: {lead.score}/100
+        Captured: {created_str}
+        
+        View this lead in your dashboard: https://dashboard.netvexa.com/leads
+        
+        Best regards,
+        The NETVEXA Team
+        '''
+        
+        html_content = _render_lead_fast(lead, created_str)
+        
+        return subject, html_content, text_content
+    
+    def send_lead_notification(self, lead: Lead, user_email: str):
+        """Send new lead notification to user"""
+        subject, html_content, text_content = self._build_lead_notification(lead)
+        return self._send_email([user_email], subject, html_content, text_content)
+    
+    def send_many(self, notifications: List[Tuple[str, Lead]]) -> int:
+        """Send lead notifications for (user_email, lead) pairs over one SMTP session"""
+        emails = [
+            ([user_email], *self._build_lead_notification(lead))
+            for user_email, lead in notifications
+        ]
+        return self._send_email_bulk(emails)
+    
+    def send_queued(self, notifications: List[Tuple]) -> int:
+        """Send queued ("lead", email, lead) and ("handoff", email, handoff, lead) notifications over one SMTP session"""
+        emails = []
+        for kind, user_email, *objects in notifications:
+            if kind == "lead":
+                emails.append(([user_email], *self._build_lead_notification(*objects)))
+            else:
+                emails.append(([user_email], *self._build_handoff_notification(*objects)))
+        return self._send_email_bulk(emails)
+    
+    def _build_handoff_notification(self, handoff: HandoffRequest, lead: Lead) -> Tuple[str, str, str]:
+        """Render subject, HTML and plain-text bodies for a handoff notification"""
+        subject = f"Human Handoff Request: {lead.email}"
+        created_str = handoff.created_at.strftime('%Y-%m-%d %H:%M UTC')
         
         text_content = f'''
         Human Handoff Request
@@ -258,7 +429,7 @@ class EmailService:
         Lead: {lead.name or lead.email}
         Priority: {handoff.priority.title()}
         Reason: {handoff.reason or 'Not specified'}
-        Requested: {handoff.created_at.strftime('%Y-%m-%d %H:%M UTC')}
+        Requested: {created_str}
         
         Lead Information:
         Email: {lead.email}
@@ -272,8 +443,13 @@ class EmailService:
         The NETVEXA Team
         '''
         
-        html_content = html_template.render(handoff=handoff, lead=lead)
+        html_content = HANDOFF_TEMPLATE.render(handoff=handoff, lead=lead, created_str=created_str)
         
+        return subject, html_content, text_content
+    
+    def send_handoff_notification(self, handoff: HandoffRequest, user_email: str, lead: Lead):
+        """Send human handoff notification to user"""
+        subject, html_content, text_content = self._build_handoff_notification(handoff, lead)
         return self._send_email([user_email], subject, html_content, text_content)
 
 
@@ -285,14 +461,29 @@ email_service = EmailService()
 async def send_lead_notification_email(lead: Lead, user_email: str):
     """Background task to send lead notification email"""
     try:
-        email_service.send_lead_notification(lead, user_email)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            smtp_executor, email_service.send_lead_notification, lead, user_email
+        )
     except Exception as e:
         logger.error(f"Failed to send lead notification email: {e}")
 
 
+async def send_lead_notification_emails(notifications: List[Tuple[str, Lead]]):
+    """Background task to send several lead notification emails at once"""
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(smtp_executor, email_service.send_many, notifications)
+    except Exception as e:
+        logger.error(f"Failed to send lead notification emails: {e}")
+
+
 async def send_handoff_notification_email(handoff: HandoffRequest, user_email: str, lead: Lead):
     """Background task to send handoff notification email"""
     try:
-        email_service.send_handoff_notification(handoff, user_email, lead)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            smtp_executor, email_service.send_handoff_notification, handoff, user_email, lead
+        )
     except Exception as e:
-        logger.error(f"Failed to send handoff notification email: {e}")
\ No newline at end of file
+        logger.error(f"Failed to send handoff notification email: {e}")
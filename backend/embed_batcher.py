@@ -0,0 +1,82 @@
+"""
+Cross-request embedding batcher.
+Coalesces concurrent single-text embedding calls into batched provider calls.
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 96
+MAX_QUEUE_TIME = 0.008  # seconds
+
+
+class AsyncEmbeddingBatcher:
+    """Queues embed requests and sends them to provider.embed_texts in batches"""
+
+    def __init__(self, provider, max_batch_size: int = MAX_BATCH_SIZE, max_queue_time: float = MAX_QUEUE_TIME):
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background batching loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, text: str) -> List[float]:
+        """Embed one text as part of the next batch"""
+        # Started lazily so engines created at import time need no startup hook
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def stop(self):
+        """Stop the batching loop"""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first request, then gather more until the batch or deadline fills
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_queue_time
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._process_batch(batch)
+
+    async def _process_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            embeddings = await self.provider.embed_texts([text for text, _ in batch])
+        except Exception as e:
+            logger.error(f"Batched embedding of {len(batch)} texts failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
@@ -3,23 +3,43 @@ Multi-Embedding Provider Support for NETVEXA
 Supports: Google, OpenAI, and local embeddings
 """
 
+import functools
 import logging
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 import numpy as np
 import asyncio
+import httpx
+import xxhash
 
-import google.generativeai as genai
 from openai import AsyncOpenAI
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from config import settings, EmbeddingProvider
+from embed_batcher import AsyncEmbeddingBatcher
 
 logger = logging.getLogger(__name__)
 
+# Dedicated pool for local model inference so it can't starve the default executor
+_EMBED_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embed")
+
+# Shared HTTP/2 client so embedding calls reuse warm TCP+TLS connections
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    timeout=30.0
+)
+
+GOOGLE_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+OPENAI_API_BASE = "https://api.openai.com/v1"
+
 class BaseEmbeddingProvider(ABC):
     """Abstract base class for embedding providers"""
     
+    __slots__ = ()
+    
     @abstractmethod
     async def embed_text(self, text: str) -> List[float]:
         """Generate embedding for a single text"""
@@ -38,35 +58,80 @@ class BaseEmbeddingProvider(ABC):
 class GoogleEmbeddingProvider(BaseEmbeddingProvider):
     """Google embedding provider using Generative AI embeddings"""
     
+    MAX_CONCURRENCY = 16  # Parallel API calls per provider
+    MAX_BATCH_SIZE = 100  # API limit for batchEmbedContents
+    
+    __slots__ = ("api_key", "model", "_semaphore")
+    
     def __init__(self, api_key: str, model: str = "models/embedding-001"):
-        genai.configure(api_key=api_key)
+        self.api_key = api_key
         self.model = model
+        self._semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
         
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
     async def embed_text(self, text: str) -> List[float]:
         try:
-            # Google's API is synchronous, run in executor
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: genai.embed_content(
-                    model=self.model,
-                    content=text,
-                    task_type="retrieval_document"
-                )
+            # REST call on the shared async client; the SDK is sync-only
+            response = await _http_client.post(
+                f"{GOOGLE_API_BASE}/{self.model}:embedContent",
+                headers={"x-goog-api-key": self.api_key},
+                json={
+                    "model": self.model,
+                    "content": {"parts": [{"text": text}]},
+                    "taskType": "RETRIEVAL_DOCUMENT"
+                }
             )
-            return result['embedding']
+            response.raise_for_status()
+            return response.json()["embedding"]["values"]
         except Exception as e:
             logger.error(f"Google embedding error: {e}")
             raise
     
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        async with self._semaphore:
+            try:
+                response = await _http_client.post(
+                    f"{GOOGLE_API_BASE}/{self.model}:batchEmbedContents",
+                    headers={"x-goog-api-key": self.api_key},
+                    json={
+                        "requests": [
+                            {
+                                "model": self.model,
+                                "content": {"parts": [{"text": text}]},
+                                "taskType": "RETRIEVAL_DOCUMENT"
+                            }
+                            for text in texts
+                        ]
+                    }
+                )
+                response.raise_for_status()
+                return [item["values"] for item in response.json()["embeddings"]]
+            except Exception as e:
+                logger.error(f"Google batch embedding error: {e}")
+                raise
+    
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
         """Batch embed multiple texts"""
-        embeddings = []
+        # batchEmbedContents takes up to MAX_BATCH_SIZE texts; batch shortest
+        # texts first so similar lengths share a request and long ones don't
+        # hold up the rest, and send the batches in parallel with bounded concurrency
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [
+            [texts[i] for i in order[start:start + self.MAX_BATCH_SIZE]]
+            for start in range(0, len(order), self.MAX_BATCH_SIZE)
+        ]
+        
+        # A batch that exhausts its retries cancels the rest instead of spending
+        # quota on a request that already failed; callers get an ExceptionGroup
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(self._embed_batch(batch)) for batch in batches]
         
-        # Google doesn't have a batch API, so we process in parallel
-        tasks = [self.embed_text(text) for text in texts]
-        embeddings = await asyncio.gather(*tasks)
+        # Restore input order
+        embeddings = [None] * len(texts)
+        results = (embedding for task in tasks for embedding in task.result())
+        for i, embedding in zip(order, results):
+            embeddings[i] = embedding
         
         return embeddings
     
@@ -77,8 +142,10 @@ class GoogleEmbeddingProvider(BaseEmbeddingProvider):
 class OpenAIEmbeddingProvider(BaseEmbeddingProvider):
     """OpenAI embedding provider"""
     
+    __slots__ = ("client", "model")
+    
     def __init__(self, api_key: str, model: str = "text-embedding-ada-002"):
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = AsyncOpenAI(api_key=api_key, http_client=_http_client)
         self.model = model
         
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
@@ -118,11 +185,31 @@ class OpenAIEmbeddingProvider(BaseEmbeddingProvider):
 class LocalEmbeddingProvider(BaseEmbeddingProvider):
     """Local embedding provider using sentence transformers (fallback option)"""
     
+    __slots__ = ("model_name", "model", "_encode_kwargs")
+    
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self.model = None
+        self._encode_kwargs = {"convert_to_tensor": False, "convert_to_numpy": True}
+        
+        if settings.LOCAL_EMBEDDINGS_QUANTIZED:
+            # ONNX Runtime with INT8 weights: same vectors, much faster on CPU
+            try:
+                from fast_sentence_transformers import FastSentenceTransformer
+                self.model = FastSentenceTransformer(model_name, device="cpu", quantize=True)
+                self._encode_kwargs = {"convert_to_numpy": True}
+                return
+            except ImportError:
+                logger.warning("fast-sentence-transformers not installed. Using PyTorch local embeddings.")
+        
         try:
             from sentence_transformers import SentenceTransformer
             self.model = SentenceTransformer(model_name)
-            self.model_name = model_name
+            
+            # Half precision halves memory traffic on GPU; CPU kernels stay FP32
+            import torch
+            if torch.cuda.is_available():
+                self.model = self.model.half()
         except ImportError:
             logger.warning("sentence-transformers not installed. Local embeddings unavailable.")
             self.model = None
@@ -132,10 +219,10 @@ class LocalEmbeddingProvider(BaseEmbeddingProvider):
             raise RuntimeError("Local embedding model not available")
         
         # Run in executor since it's CPU-bound
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         embedding = await loop.run_in_executor(
-            None,
-            lambda: self.model.encode(text, convert_to_numpy=True)
+            _EMBED_POOL,
+            functools.partial(self.model.encode, text, **self._encode_kwargs)
         )
         return embedding.tolist()
     
@@ -144,10 +231,10 @@ class LocalEmbeddingProvider(BaseEmbeddingProvider):
             raise RuntimeError("Local embedding model not available")
         
         # Run in executor since it's CPU-bound
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         embeddings = await loop.run_in_executor(
-            None,
-            lambda: self.model.encode(texts, convert_to_numpy=True)
+            _EMBED_POOL,
+            functools.partial(self.model.encode, texts, batch_size=64, **self._encode_kwargs)
         )
         return embeddings.tolist()
     
@@ -163,12 +250,13 @@ class EmbeddingProviderFactory:
     """Factory class to create embedding providers"""
     
     @staticmethod
+    @functools.lru_cache(maxsize=8)
     def create_provider(
         provider_type: Optional[EmbeddingProvider] = None,
         api_key: Optional[str] = None,
         model: Optional[str] = None
     ) -> BaseEmbeddingProvider:
-        """Create an embedding provider instance"""
+        """Create an embedding provider instance, reused per argument set"""
         
         # Use settings if not provided
         if provider_type is None:
@@ -203,95 +291,175 @@ class EmbeddingProviderFactory:
             
         return available
 
+async def warm_http_client():
+    """Open connections to the configured embedding APIs before the first request"""
+    urls = []
+    if settings.GOOGLE_API_KEY:
+        urls.append(GOOGLE_API_BASE)
+    if settings.OPENAI_API_KEY:
+        urls.append(OPENAI_API_BASE)
+    
+    # Any response, even an auth error, leaves a pooled keep-alive connection behind
+    results = await asyncio.gather(
+        *(_http_client.head(url, timeout=5.0) for url in urls),
+        return_exceptions=True
+    )
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not pre-connect to {url}: {result}")
+
+async def close_http_client():
+    """Close the shared HTTP client's pooled connections"""
+    await _http_client.aclose()
+
+def normalize_for_storage(embedding: List[float]) -> np.ndarray:
+    """Unit-normalize an embedding and narrow it to float16 for the halfvec column"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    vector /= np.linalg.norm(vector) + 1e-9
+    return vector.astype(np.float16)
+
+# One-byte format tag prefixed to cached embedding values
+_CACHE_FORMAT_FLOAT32 = b"\x01"
+
+def _encode_embedding(embedding: List[float]) -> bytes:
+    """Pack an embedding as tagged raw float32 bytes for the cache"""
+    return _CACHE_FORMAT_FLOAT32 + np.asarray(embedding, dtype=np.float32).tobytes()
+
+def _decode_embedding(value: bytes) -> Optional[List[float]]:
+    """Unpack a cached embedding, or None for unknown/legacy formats"""
+    if value[:1] != _CACHE_FORMAT_FLOAT32:
+        return None
+    return np.frombuffer(value, dtype=np.float32, offset=1).tolist()
+
 class CachedEmbeddingProvider:
     """Wrapper that provides caching for embeddings"""
     
-    def __init__(self, provider: BaseEmbeddingProvider, cache_client=None):
+    __slots__ = (
+        "provider", "cache_client", "cache_ttl", "_provider_name",
+        "_local_cache", "_local_max", "_inflight", "_batcher"
+    )
+    
+    def __init__(self, provider: BaseEmbeddingProvider, cache_client=None, local_cache_size: int = 4096):
         self.provider = provider
         self.cache_client = cache_client
         self.cache_ttl = 86400 * 7  # 7 days
+        self._provider_name = provider.__class__.__name__
+        # In-process LRU in front of Redis for hot texts
+        self._local_cache: OrderedDict = OrderedDict()
+        self._local_max = local_cache_size
+        # Pending lookups by cache key, shared by concurrent callers
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Cache misses from concurrent requests are embedded in shared batches
+        self._batcher = AsyncEmbeddingBatcher(provider)
     
     def _get_cache_key(self, text: str) -> str:
         """Generate cache key for text"""
-        import hashlib
-        text_hash = hashlib.md5(text.encode()).hexdigest()
-        return f"embedding:{self.provider.__class__.__name__}:{text_hash}"
+        text_hash = xxhash.xxh3_128_hexdigest(text.encode('utf-8'))
+        return f"embedding:{self._provider_name}:{text_hash}"
+    
+    def _get_local(self, cache_key: str) -> Optional[List[float]]:
+        embedding = self._local_cache.get(cache_key)
+        if embedding is not None:
+            self._local_cache.move_to_end(cache_key)
+        return embedding
+    
+    def _set_local(self, cache_key: str, embedding: List[float]):
+        self._local_cache[cache_key] = embedding
+        self._local_cache.move_to_end(cache_key)
+        if len(self._local_cache) > self._local_max:
+            self._local_cache.popitem(last=False)
     
     async def embed_text(self, text: str) -> List[float]:
         """Embed text with caching"""
-        if not self.cache_client or not settings.ENABLE_CACHE:
+        if not settings.ENABLE_CACHE:
             return await self.provider.embed_text(text)
         
-        # Try to get from cache
         cache_key = self._get_cache_key(text)
-        try:
-            cached = await self.cache_client.get(cache_key)
-            if cached:
-                import json
-                return json.loads(cached)
-        except Exception as e:
-            logger.warning(f"Cache retrieval error: {e}")
+        embedding = self._get_local(cache_key)
+        if embedding is not None:
+            return embedding
+        
+        # Concurrent calls for the same text share one lookup/provider call
+        inflight = self._inflight.get(cache_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._embed_text_uncached(text, cache_key))
+            self._inflight[cache_key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        
+        # Shield so one caller's cancellation doesn't cancel the shared call
+        return await asyncio.shield(inflight)
+    
+    async def _embed_text_uncached(self, text: str, cache_key: str) -> List[float]:
+        """Embed text via Redis or the provider, filling both cache tiers"""
+        # Try to get from cache
+        if self.cache_client:
+            try:
+                cached = await self.cache_client.get(cache_key)
+                if cached:
+                    embedding = _decode_embedding(cached)
+                    if embedding is not None:
+                        self._set_local(cache_key, embedding)
+                        return embedding
+            except Exception as e:
+                logger.warning(f"Cache retrieval error: {e}")
         
         # Generate embedding
-        embedding = await self.provider.embed_text(text)
+        embedding = await self._batcher.submit(text)
+        self._set_local(cache_key, embedding)
         
         # Store in cache
-        try:
-            import json
-            await self.cache_client.setex(
-                cache_key,
-                self.cache_ttl,
-                json.dumps(embedding)
-            )
-        except Exception as e:
-            logger.warning(f"Cache storage error: {e}")
+        if self.cache_client:
+            try:
+                await self.cache_client.setex(
+                    cache_key,
+                    self.cache_ttl,
+                    _encode_embedding(embedding)
+                )
+            except Exception as e:
+                logger.warning(f"Cache storage error: {e}")
         
         return embedding
     
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
         """Batch embed with caching"""
-        if not self.cache_client or not settings.ENABLE_CACHE:
+        if not settings.ENABLE_CACHE:
             return await self.provider.embed_texts(texts)
         
-        # Check cache for each text
-        embeddings = []
-        uncached_texts = []
-        uncached_indices = []
+        cache_keys = [self._get_cache_key(text) for text in texts]
+        embeddings = [self._get_local(key) for key in cache_keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
         
-        for i, text in enumerate(texts):
-            cache_key = self._get_cache_key(text)
+        # Look up the rest in a single MGET round-trip
+        if missing and self.cache_client:
             try:
-                cached = await self.cache_client.get(cache_key)
-                if cached:
-                    import json
-                    embeddings.append(json.loads(cached))
-                else:
-                    embeddings.append(None)
-                    uncached_texts.append(text)
-                    uncached_indices.append(i)
+                cached_values = await self.cache_client.mget([cache_keys[i] for i in missing])
             except Exception as e:
                 logger.warning(f"Cache retrieval error: {e}")
-                embeddings.append(None)
-                uncached_texts.append(text)
-                uncached_indices.append(i)
+                cached_values = [None] * len(missing)
+            
+            for i, cached in zip(missing, cached_values):
+                embedding = _decode_embedding(cached) if cached else None
+                if embedding is not None:
+                    embeddings[i] = embedding
+                    self._set_local(cache_keys[i], embedding)
+        
+        uncached_indices = [i for i in missing if embeddings[i] is None]
         
         # Generate embeddings for uncached texts
-        if uncached_texts:
-            new_embeddings = await self.provider.embed_texts(uncached_texts)
+        if uncached_indices:
+            new_embeddings = await self.provider.embed_texts([texts[i] for i in uncached_indices])
             
-            # Update results and cache
             for i, embedding in zip(uncached_indices, new_embeddings):
                 embeddings[i] = embedding
-                
-                # Store in cache
+                self._set_local(cache_keys[i], embedding)
+            
+            # Store in cache with one pipelined round-trip
+            if self.cache_client:
                 try:
-                    import json
-                    cache_key = self._get_cache_key(texts[i])
-                    await self.cache_client.setex(
-                        cache_key,
-                        self.cache_ttl,
-                        json.dumps(embedding)
-                    )
+                    async with self.cache_client.pipeline(transaction=False) as pipe:
+                        for i in uncached_indices:
+                            pipe.setex(cache_keys[i], self.cache_ttl, _encode_embedding(embeddings[i]))
+                        await pipe.execute()
                 except Exception as e:
                     logger.warning(f"Cache storage error: {e}")
         
@@ -1,24 +1,68 @@
 """
 Knowledge management API routes for document ingestion and search
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Path
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, delete, func, literal_column, Integer
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
+import json
 import logging
 import os
+import shutil
 import tempfile
+import time
+import uuid
 
-from database import get_db, User
+from cachetools import TTLCache
+from starlette.concurrency import run_in_threadpool
+
+from database import get_db, User, Agent, KnowledgeDocument
+from models import UUID_PATTERN
 from auth import get_current_user
-from rag import ProductionRAGEngine
+from rag import get_rag_engine
 from billing_service import BillingService
 
 router = APIRouter(prefix="/api/knowledge", tags=["knowledge"])
 logger = logging.getLogger(__name__)
 
 # Initialize RAG engine
-rag_engine = ProductionRAGEngine()
+rag_engine = get_rag_engine()
+
+# Chunk metadata paths; spelled as literal SQL so they match the expression index
+_ORIGINAL_FILENAME = literal_column("meta_data -> 'custom_metadata' ->> 'original_filename'")
+_DOCUMENT_TYPE = literal_column("meta_data -> 'document_metadata' ->> 'type'")
+_DOCUMENT_SIZE = literal_column("(meta_data -> 'document_metadata' ->> 'size')::bigint", Integer)
+
+# agent_id -> owner user_id; only confirmed ownership is cached. The cache is per
+# process, so invalidation misses other workers: only read endpoints trust it
+_agent_owner_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+
+async def verify_agent(agent_id: str, user: User, db: AsyncSession, cached: bool = False) -> bool:
+    """Check that the user owns the agent; with cached=True, hit the database only on a cache miss"""
+    try:
+        uuid.UUID(agent_id)
+    except ValueError:
+        return False  # Not an agent id; don't let the uuid cast fail the request
+    
+    if cached and _agent_owner_cache.get(agent_id) == user.id:
+        return True
+    
+    result = await db.execute(
+        select(Agent.id).where(Agent.id == agent_id, Agent.user_id == user.id)
+    )
+    if result.scalar_one_or_none() is None:
+        return False
+    
+    _agent_owner_cache[agent_id] = user.id
+    return True
+
+
+def invalidate_agent_owner(agent_id: str):
+    """Drop a cached ownership entry after the agent is deleted or transferred"""
+    _agent_owner_cache.pop(agent_id, None)
 
 
 class IngestURLRequest(BaseModel):
@@ -59,15 +103,7 @@ async def ingest_file(
     """Upload and ingest a document file"""
     try:
         # Check if user owns the agent
-        from database import Agent
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Agent).where(Agent.id == agent_id, Agent.user_id == current_user.id)
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(agent_id, current_user, db):
             raise HTTPException(status_code=404, detail="Agent not found")
         
         # Check document processing limits
@@ -84,7 +120,6 @@ async def ingest_file(
         # Parse metadata if provided
         parsed_metadata = {}
         if metadata:
-            import json
             try:
                 parsed_metadata = json.loads(metadata)
             except:
@@ -97,10 +132,9 @@ async def ingest_file(
             'size': file.size
         })
         
-        # Save uploaded file temporarily
+        # Stream the spooled upload to disk in 1MB chunks off the event loop
         with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp_file, 1024 * 1024)
             tmp_file_path = tmp_file.name
         
         try:
@@ -142,15 +176,7 @@ async def ingest_text(
     """Ingest raw text content"""
     try:
         # Check if user owns the agent
-        from database import Agent
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Agent).where(Agent.id == request.agent_id, Agent.user_id == current_user.id)
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(request.agent_id, current_user, db):
             raise HTTPException(status_code=404, detail="Agent not found")
         
         # Create temporary file with text content
@@ -202,19 +228,10 @@ async def ingest_url(
     """Ingest content from a URL"""
     try:
         # Check if user owns the agent
-        from database import Agent
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Agent).where(Agent.id == request.agent_id, Agent.user_id == current_user.id)
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(request.agent_id, current_user, db):
             raise HTTPException(status_code=404, detail="Agent not found")
         
         # For now, return a job ID (full implementation would crawl and process)
-        import uuid
         job_id = str(uuid.uuid4())
         
         # In production, this would:
@@ -244,19 +261,10 @@ async def search_knowledge(
     """Search the knowledge base"""
     try:
         # Check if user owns the agent
-        from database import Agent
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Agent).where(Agent.id == request.agent_id, Agent.user_id == current_user.id)
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(request.agent_id, current_user, db, cached=True):
             raise HTTPException(status_code=404, detail="Agent not found")
         
         # Perform search
-        import time
         start_time = time.time()
         
         search_results = await rag_engine.search(
@@ -270,9 +278,8 @@ async def search_knowledge(
         search_time = (time.time() - start_time) * 1000  # Convert to milliseconds
         
         # Format results
-        formatted_results = []
-        for result in search_results:
-            formatted_results.append({
+        formatted_results = [
+            {
                 'document_id': result.document_id,
                 'content': result.content,
                 'score': result.combined_score,
@@ -280,13 +287,17 @@ async def search_knowledge(
                 'keyword_score': result.keyword_score,
                 'highlights': result.highlights,
                 'metadata': result.metadata
-            })
-        
-        return SearchResponse(
-            results=formatted_results,
-            total_results=len(formatted_results),
-            search_time_ms=search_time
-        )
+            }
+            for result in search_results
+        ]
+        
+        # Already SearchResponse-shaped; orjson encodes numpy scores directly
+        # and the response bypasses Pydantic validation
+        return ORJSONResponse({
+            'results': formatted_results,
+            'total_results': len(formatted_results),
+            'search_time_ms': search_time
+        })
         
     except HTTPException:
         raise
@@ -297,7 +308,7 @@ async def search_knowledge(
 
 @router.get("/agents/{agent_id}/documents")
 async def list_agent_documents(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     skip: int = 0,
     limit: int = 20,
     current_user: User = Depends(get_current_user),
@@ -306,54 +317,47 @@ async def list_agent_documents(
     """List all documents for an agent"""
     try:
         # Check if user owns the agent
-        from database import Agent, KnowledgeDocument
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Agent).where(Agent.id == agent_id, Agent.user_id == current_user.id)
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(agent_id, current_user, db, cached=True):
             raise HTTPException(status_code=404, detail="Agent not found")
         
-        # Get documents with unique entries (group by chunk metadata)
-        # In a real implementation, we'd have a separate documents table
+        # A search usually follows opening the documents view
+        rag_engine.schedule_query_prefetch(agent_id)
+        
+        # One row per original document, grouped in SQL instead of loading every chunk
+        doc_key = func.coalesce(_ORIGINAL_FILENAME, KnowledgeDocument.title)
         result = await db.execute(
-            select(KnowledgeDocument)
+            select(
+                func.min(KnowledgeDocument.id).label("id"),
+                func.min(KnowledgeDocument.title).label("title"),
+                func.min(_ORIGINAL_FILENAME).label("filename"),
+                func.min(_DOCUMENT_TYPE).label("type"),
+                func.max(_DOCUMENT_SIZE).label("size"),
+                func.count().label("chunks"),
+                func.min(KnowledgeDocument.created_at).label("created_at"),
+            )
             .where(KnowledgeDocument.agent_id == agent_id)
+            .group_by(doc_key)
+            .order_by(func.min(KnowledgeDocument.created_at))
             .offset(skip)
             .limit(limit)
         )
-        documents = result.scalars().all()
-        
-        # Group by original document
-        unique_docs = {}
-        for doc in documents:
-            # Extract original document info from metadata
-            doc_meta = doc.metadata or {}
-            doc_info = doc_meta.get('document_metadata', {})
-            custom_meta = doc_meta.get('custom_metadata', {})
-            
-            # Create a unique key for the document
-            doc_key = custom_meta.get('original_filename', doc.title)
-            
-            if doc_key not in unique_docs:
-                unique_docs[doc_key] = {
-                    'id': doc.id,
-                    'title': doc.title,
-                    'filename': custom_meta.get('original_filename'),
-                    'type': doc_info.get('type', 'unknown'),
-                    'size': doc_info.get('size', 0),
-                    'chunks': 1,
-                    'created_at': doc.created_at.isoformat() if doc.created_at else None
-                }
-            else:
-                unique_docs[doc_key]['chunks'] += 1
+        
+        documents = [
+            {
+                'id': row.id,
+                'title': row.title,
+                'filename': row.filename,
+                'type': row.type or 'unknown',
+                'size': int(row.size or 0),
+                'chunks': row.chunks,
+                'created_at': row.created_at.isoformat() if row.created_at else None
+            }
+            for row in result
+        ]
         
         return {
-            "documents": list(unique_docs.values()),
-            "total": len(unique_docs),
+            "documents": documents,
+            "total": len(documents),
             "skip": skip,
             "limit": limit
         }
@@ -374,9 +378,6 @@ async def delete_document(
     """Delete a document and all its chunks"""
     try:
         # Get document
-        from database import KnowledgeDocument
-        from sqlalchemy import select, delete
-        
         result = await db.execute(
             select(KnowledgeDocument).where(KnowledgeDocument.id == document_id)
         )
@@ -386,16 +387,7 @@ async def delete_document(
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Check if user owns the agent
-        from database import Agent
-        result = await db.execute(
-            select(Agent).where(
-                Agent.id == document.agent_id, 
-                Agent.user_id == current_user.id
-            )
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(document.agent_id, current_user, db):
             raise HTTPException(status_code=403, detail="Access denied")
         
         # Delete all chunks with same original document
@@ -429,22 +421,14 @@ async def delete_document(
 
 @router.post("/update-embeddings/{agent_id}")
 async def update_embeddings(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """Update embeddings for documents without them"""
     try:
         # Check if user owns the agent
-        from database import Agent
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Agent).where(Agent.id == agent_id, Agent.user_id == current_user.id)
-        )
-        agent = result.scalar_one_or_none()
-        
-        if not agent:
+        if not await verify_agent(agent_id, current_user, db):
             raise HTTPException(status_code=404, detail="Agent not found")
         
         # Update embeddings
@@ -4,7 +4,8 @@ Lead management models for NETVEXA.
 Handles lead capture, human handoff requests, and lead scoring.
 """
 
-from sqlalchemy import Column, String, DateTime, JSON, Float, Integer, Text, Boolean, ForeignKey, Enum
+from sqlalchemy import Column, String, DateTime, Float, Integer, SmallInteger, Text, Boolean, ForeignKey, Enum, Uuid, UniqueConstraint, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -39,22 +40,32 @@ class HandoffStatus(enum.Enum):
     CANCELLED = "cancelled"
 
 
+def _pg_enum(enum_cls):
+    """Native PostgreSQL enum type keyed by member name, without a CHECK constraint.
+
+    These are SQLAlchemy's defaults on PostgreSQL, spelled out so the type stays
+    the same. Labels must remain the member names already stored in existing
+    databases: adding values_callable would need a migration renaming them.
+    """
+    return Enum(enum_cls, native_enum=True, create_constraint=False, validate_strings=False)
+
+
 class Lead(Base):
     __tablename__ = "leads"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=True)
-    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, server_default=text("gen_random_uuid()"))
+    conversation_id = Column(Uuid(as_uuid=False), ForeignKey("conversations.id"), nullable=True)
+    agent_id = Column(Uuid(as_uuid=False), ForeignKey("agents.id"), nullable=False)
     
     # Contact Information
-    email = Column(String, nullable=False, index=True)
+    email = Column(String, nullable=False)  # Indexed by uq_leads_email_agent
     name = Column(String, nullable=True)
     phone = Column(String, nullable=True)
     company = Column(String, nullable=True)
     
     # Lead Details
-    status = Column(Enum(LeadStatus), default=LeadStatus.NEW)
-    source = Column(Enum(LeadSource), default=LeadSource.CHAT_WIDGET)
+    status = Column(_pg_enum(LeadStatus), default=LeadStatus.NEW)
+    source = Column(_pg_enum(LeadSource), default=LeadSource.CHAT_WIDGET)
     score = Column(Float, default=0.0)  # Lead quality score 0-100
     
     # Tracking
@@ -63,27 +74,47 @@ class Lead(Base):
     contacted_at = Column(DateTime, nullable=True)
     
     # Additional Data
-    custom_fields = Column(JSON, default={})  # Flexible field storage
+    custom_fields = Column(JSONB, default={})  # Flexible field storage
     notes = Column(Text, nullable=True)
-    tags = Column(JSON, default=[])
+    tags = Column(JSONB, default=[])
     
     # Relationships
     conversation = relationship("Conversation", backref="lead_info")
     agent = relationship("Agent", backref="captured_leads")
     handoff_requests = relationship("HandoffRequest", back_populates="lead")
+    
+    __table_args__ = (
+        # One lead per email per agent; create_lead upserts on this
+        UniqueConstraint("email", "agent_id", name="uq_leads_email_agent"),
+        # Per-agent date-range scans for analytics
+        Index("ix_leads_agent_created", "agent_id", "created_at"),
+        # get_leads filters by agent and status, newest first
+        Index("ix_leads_agent_status_created", "agent_id", "status", "created_at"),
+        # Containment filters on tags (tags @> '["enterprise"]')
+        Index("ix_leads_tags_gin", "tags", postgresql_using="gin"),
+    )
+
+
+# Handoff priorities as sortable ranks; unknown values rank as normal
+HANDOFF_PRIORITY_RANKS = {"low": 1, "normal": 2, "high": 3, "urgent": 4}
+
+
+def _priority_rank_default(context):
+    return HANDOFF_PRIORITY_RANKS.get(context.get_current_parameters().get("priority"), 2)
 
 
 class HandoffRequest(Base):
     __tablename__ = "handoff_requests"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    lead_id = Column(String, ForeignKey("leads.id"), nullable=False)
-    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
-    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, server_default=text("gen_random_uuid()"))
+    lead_id = Column(Uuid(as_uuid=False), ForeignKey("leads.id"), nullable=False)
+    conversation_id = Column(Uuid(as_uuid=False), ForeignKey("conversations.id"), nullable=False)
+    agent_id = Column(Uuid(as_uuid=False), ForeignKey("agents.id"), nullable=False)
     
     # Request Details
-    status = Column(Enum(HandoffStatus), default=HandoffStatus.PENDING)
+    status = Column(_pg_enum(HandoffStatus), default=HandoffStatus.PENDING)
     priority = Column(String, default="normal")  # low, normal, high, urgent
+    priority_rank = Column(SmallInteger, default=_priority_rank_default)  # Derived from priority on insert
     reason = Column(Text, nullable=True)
     
     # Assignment
@@ -103,20 +134,25 @@ class HandoffRequest(Base):
     lead = relationship("Lead", back_populates="handoff_requests")
     conversation = relationship("Conversation", backref="handoff_request")
     agent = relationship("Agent", backref="handoff_requests")
+    
+    __table_args__ = (
+        # Pending queue per agent: most urgent first, then oldest
+        Index("ix_handoff_agent_status_priority", "agent_id", "status", priority_rank.desc(), "created_at"),
+    )
 
 
 class LeadForm(Base):
     __tablename__ = "lead_forms"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, server_default=text("gen_random_uuid()"))
+    agent_id = Column(Uuid(as_uuid=False), ForeignKey("agents.id"), nullable=False)
     
     # Form Configuration
     name = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     
     # Form Fields Configuration
-    fields = Column(JSON, nullable=False)
+    fields = Column(JSONB, nullable=False)
     # Example structure:
     # [
     #   {"name": "email", "type": "email", "required": true, "label": "Email"},
@@ -126,11 +162,11 @@ class LeadForm(Base):
     # ]
     
     # Form Triggers
-    trigger_conditions = Column(JSON, default={})
+    trigger_conditions = Column(JSONB, default={})
     # Example: {"keywords": ["pricing", "demo", "contact"], "message_count": 5}
     
     # Styling
-    custom_styles = Column(JSON, default={})
+    custom_styles = Column(JSONB, default={})
     
     # Tracking
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -139,7 +175,3 @@ class LeadForm(Base):
     
     # Relationships
     agent = relationship("Agent", backref="lead_forms")
-
-
-# Import uuid at the top of the file
-import uuid
\ No newline at end of file
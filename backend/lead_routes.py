@@ -4,23 +4,46 @@ Lead management API routes.
 Handles lead capture, retrieval, and human handoff requests.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi.responses import Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func
-from pydantic import BaseModel, EmailStr
+from sqlalchemy import select, update, and_, func, tuple_, lambda_stmt, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from pydantic import BaseModel, ConfigDict, EmailStr, TypeAdapter
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 import logging
+import uuid
+from urllib.parse import urlencode
+import orjson
+import redis.asyncio as redis
+
+from config import settings
 
 from database import get_db, User, Agent, Conversation
+from models import UUID_PATTERN
 from auth import get_current_user
 from lead_models import Lead, HandoffRequest, LeadForm, LeadStatus, LeadSource, HandoffStatus
-from email_service import send_lead_notification_email, send_handoff_notification_email
+from notification_queue import notification_queue
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/leads", tags=["leads"])
 
+# Cache for the public lead form endpoint, which the widget calls on every page load
+LEAD_FORMS_CACHE_TTL = 300  # seconds
+
+redis_client = None
+if settings.REDIS_URL and settings.ENABLE_CACHE:
+    try:
+        redis_client = redis.from_url(settings.REDIS_URL)
+    except Exception as e:
+        logger.warning(f"Failed to initialize Redis for lead forms cache: {e}")
+
+
+def _lead_forms_cache_key(agent_id: str) -> str:
+    return f"lead_forms:{agent_id}"
+
 
 # Pydantic models
 class LeadCreate(BaseModel):
@@ -33,6 +56,7 @@ class LeadCreate(BaseModel):
     company: Optional[str] = None
     custom_fields: Optional[Dict[str, Any]] = {}
     source: Optional[LeadSource] = LeadSource.CHAT_WIDGET
+    form_id: Optional[uuid.UUID] = None  # Lead form that captured the lead, if any
 
 
 class LeadUpdate(BaseModel):
@@ -49,6 +73,8 @@ class LeadUpdate(BaseModel):
 
 class LeadResponse(BaseModel):
     """Lead response model"""
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
+    
     id: str
     conversation_id: Optional[str]
     agent_id: str
@@ -77,6 +103,8 @@ class HandoffRequestCreate(BaseModel):
 
 class HandoffRequestResponse(BaseModel):
     """Handoff request response"""
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
+    
     id: str
     lead_id: str
     conversation_id: str
@@ -90,6 +118,25 @@ class HandoffRequestResponse(BaseModel):
     completed_at: Optional[datetime]
 
 
+# List endpoints validate and serialize whole pages in one pydantic-core call
+_LEAD_LIST = TypeAdapter(List[LeadResponse])
+_HANDOFF_LIST = TypeAdapter(List[HandoffRequestResponse])
+
+
+def _json_list(adapter: TypeAdapter, rows, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Validate rows once and return them pre-serialized, skipping FastAPI's second pass"""
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(rows)),
+        media_type="application/json",
+        headers=headers
+    )
+
+
+# Columns the list endpoints select instead of hydrating full ORM entities
+_LEAD_RESPONSE_COLUMNS = [getattr(Lead, name) for name in LeadResponse.model_fields]
+_HANDOFF_RESPONSE_COLUMNS = [getattr(HandoffRequest, name) for name in HandoffRequestResponse.model_fields]
+
+
 class LeadFormConfig(BaseModel):
     """Lead form configuration"""
     name: str
@@ -98,57 +145,84 @@ class LeadFormConfig(BaseModel):
     custom_styles: Optional[Dict[str, Any]] = {}
 
 
+def _user_agent_ids(user: User):
+    """Subquery of the user's agent ids, so ownership filters stay server-side"""
+    return select(Agent.id).where(Agent.user_id == user.id).scalar_subquery()
+
+
+async def _get_agent_owner_email(db: AsyncSession, agent_id: str) -> Optional[str]:
+    """Fetch the notification email of an agent's owner in one query"""
+    result = await db.execute(
+        lambda_stmt(
+            lambda: select(User.email)
+            .join(Agent, Agent.user_id == User.id)
+            .where(Agent.id == agent_id)
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+async def bump_submission_count(db: AsyncSession, form_id: str, agent_id: str):
+    """Count a lead form submission atomically.
+    
+    Always increment in SQL like this rather than reading submission_count
+    and writing it back, which loses updates under concurrent submissions.
+    Only the agent's own form is counted. The caller commits.
+    """
+    await db.execute(
+        update(LeadForm)
+        .where(LeadForm.id == form_id, LeadForm.agent_id == agent_id)
+        .values(submission_count=LeadForm.submission_count + 1)
+    )
+
+
 # Lead CRUD operations
 @router.post("/", response_model=LeadResponse)
 async def create_lead(
     lead_data: LeadCreate,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
     """Create a new lead from chat conversation"""
     try:
-        # Check if lead already exists for this email
-        existing_lead = await db.execute(
-            select(Lead).where(
-                and_(
-                    Lead.email == lead_data.email,
-                    Lead.agent_id == lead_data.agent_id
-                )
+        lead_dict = lead_data.model_dump(exclude={'form_id'})
+        # Set conversation_id to NULL if the conversation doesn't exist
+        if lead_dict.get('conversation_id'):
+            lead_dict['conversation_id'] = (
+                select(Conversation.id)
+                .where(Conversation.id == lead_dict['conversation_id'])
+                .scalar_subquery()
             )
+        
+        # Insert, or update the existing lead for this email with the provided fields
+        update_fields = {
+            key: lead_dict[key]
+            for key in lead_data.model_dump(exclude_unset=True, exclude_none=True, exclude={'form_id'})
+            if key not in ('email', 'agent_id')
+        }
+        update_fields['updated_at'] = datetime.utcnow()
+        
+        stmt = (
+            pg_insert(Lead)
+            .values(**lead_dict)
+            .on_conflict_do_update(
+                index_elements=['email', 'agent_id'],
+                set_=update_fields
+            )
+            .returning(Lead)
         )
-        existing = existing_lead.scalar_one_or_none()
-        
-        if existing:
-            # Update existing lead
-            for key, value in lead_data.dict(exclude_unset=True).items():
-                if hasattr(existing, key) and value is not None:
-                    setattr(existing, key, value)
-            existing.updated_at = datetime.utcnow()
-            lead = existing
-        else:
-            # Create new lead
-            lead_dict = lead_data.dict()
-            # Set conversation_id to None if the conversation doesn't exist
-            if lead_dict.get('conversation_id'):
-                conv_exists = await db.execute(
-                    select(1).where(Conversation.id == lead_dict['conversation_id'])
-                )
-                if not conv_exists.scalar():
-                    lead_dict['conversation_id'] = None
-            
-            lead = Lead(**lead_dict)
-            db.add(lead)
+        result = await db.execute(stmt)
+        lead = result.scalar_one()
+        
+        if lead_data.form_id:
+            await bump_submission_count(db, str(lead_data.form_id), lead_data.agent_id)
         
         await db.commit()
-        await db.refresh(lead)
         
         # Get agent owner's email for notification
-        agent = await db.get(Agent, lead.agent_id)
-        if agent:
-            user = await db.get(User, agent.user_id)
-            if user:
-                # Send email notification in background
-                background_tasks.add_task(send_lead_notification_email, lead, user.email)
+        owner_email = await _get_agent_owner_email(db, lead.agent_id)
+        if owner_email:
+            # Send email notification from the batching queue
+            notification_queue.enqueue_lead(lead, owner_email)
         
         return lead
     except Exception as e:
@@ -158,36 +232,62 @@ async def create_lead(
 
 @router.get("/", response_model=List[LeadResponse])
 async def get_leads(
-    agent_id: Optional[str] = None,
+    agent_id: Optional[str] = Query(None, pattern=UUID_PATTERN),
     status: Optional[LeadStatus] = None,
+    tag: Optional[str] = None,
     limit: int = 100,
     offset: int = 0,
+    before: Optional[datetime] = None,
+    before_id: Optional[uuid.UUID] = None,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get leads with optional filtering"""
+    """Get leads with optional filtering, newest first.
+    
+    Page with the before/before_id cursor returned in X-Next-Cursor;
+    offset is kept for existing clients but deep offsets are slow.
+    """
+    if (before is None) != (before_id is None):
+        raise HTTPException(status_code=400, detail="before and before_id must be given together")
+    
     try:
-        query = select(Lead)
+        # Built conventionally: the optional filters give this query too many
+        # shapes for lambda_stmt caching to pay off
+        query = select(*_LEAD_RESPONSE_COLUMNS)
         
         # Filter by user's agents
-        user_agents = await db.execute(
-            select(Agent.id).where(Agent.user_id == current_user.id)
-        )
-        agent_ids = [a[0] for a in user_agents]
-        query = query.where(Lead.agent_id.in_(agent_ids))
+        query = query.where(Lead.agent_id.in_(_user_agent_ids(current_user)))
         
         # Additional filters
         if agent_id:
             query = query.where(Lead.agent_id == agent_id)
         if status:
             query = query.where(Lead.status == status)
+        if tag:
+            # JSONB containment, served by the GIN index on tags
+            query = query.where(Lead.tags.contains([tag]))
+        
+        # Keyset pagination: seek past the previous page instead of skipping rows
+        if before is not None:
+            query = query.where(tuple_(Lead.created_at, Lead.id) < tuple_(before, str(before_id)))
         
-        query = query.order_by(Lead.created_at.desc()).limit(limit).offset(offset)
+        query = query.order_by(Lead.created_at.desc(), Lead.id.desc()).limit(limit)
+        if offset:
+            query = query.offset(offset)
         
+        # Plain rows; the response model reads their attributes
         result = await db.execute(query)
-        leads = result.scalars().all()
+        leads = result.all()
         
-        return leads
+        headers = None
+        if len(leads) == limit:
+            last = leads[-1]
+            headers = {"X-Next-Cursor": urlencode({
+                "before": last.created_at.isoformat(),
+                "before_id": last.id
+            })}
+        
+        return _json_list(_LEAD_LIST, leads, headers)
     except Exception as e:
         logger.error(f"Error fetching leads: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -195,7 +295,7 @@ async def get_leads(
 
 @router.get("/{lead_id}", response_model=LeadResponse)
 async def get_lead(
-    lead_id: str,
+    lead_id: str = Path(pattern=UUID_PATTERN),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -220,31 +320,37 @@ async def get_lead(
 
 @router.put("/{lead_id}", response_model=LeadResponse)
 async def update_lead(
-    lead_id: str,
     lead_update: LeadUpdate,
+    lead_id: str = Path(pattern=UUID_PATTERN),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """Update lead information"""
     try:
-        lead = await db.get(Lead, lead_id)
-        if not lead:
-            raise HTTPException(status_code=404, detail="Lead not found")
-        
-        # Verify user owns the agent
-        agent = await db.get(Agent, lead.agent_id)
-        if not agent or agent.user_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Access denied")
+        data = lead_update.model_dump(exclude_unset=True, exclude_none=True)
+        data['updated_at'] = datetime.utcnow()
         
-        # Update fields
-        for key, value in lead_update.dict(exclude_unset=True).items():
-            if value is not None:
-                setattr(lead, key, value)
+        # Update and return the lead in one statement, scoped to the user's agents
+        result = await db.execute(
+            update(Lead)
+            .where(
+                and_(
+                    Lead.id == lead_id,
+                    Lead.agent_id.in_(_user_agent_ids(current_user))
+                )
+            )
+            .values(**data)
+            .returning(Lead)
+        )
+        lead = result.scalar_one_or_none()
         
-        lead.updated_at = datetime.utcnow()
+        if not lead:
+            # Only the failure path pays for telling missing from not owned
+            if await db.get(Lead, lead_id):
+                raise HTTPException(status_code=403, detail="Access denied")
+            raise HTTPException(status_code=404, detail="Lead not found")
         
         await db.commit()
-        await db.refresh(lead)
         
         return lead
     except HTTPException:
@@ -258,7 +364,6 @@ async def update_lead(
 @router.post("/handoff", response_model=HandoffRequestResponse)
 async def create_handoff_request(
     handoff_data: HandoffRequestCreate,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
     """Create a human handoff request"""
@@ -269,19 +374,19 @@ async def create_handoff_request(
             raise HTTPException(status_code=404, detail="Lead not found")
         
         # Create handoff request
-        handoff = HandoffRequest(**handoff_data.dict())
+        handoff = HandoffRequest(**handoff_data.model_dump())
         db.add(handoff)
         
+        # The only server-side default is the gen_random_uuid() id, which the
+        # INSERT fetches with RETURNING; the rest are client-side and sessions
+        # don't expire on commit, so the object is complete without a refresh
         await db.commit()
-        await db.refresh(handoff)
         
-        # Get lead and user email for notification
-        agent = await db.get(Agent, handoff.agent_id)
-        if agent:
-            user = await db.get(User, agent.user_id)
-            if user:
-                # Notify human agents in background
-                background_tasks.add_task(send_handoff_notification_email, handoff, user.email, lead)
+        # Get agent owner's email for notification
+        owner_email = await _get_agent_owner_email(db, handoff.agent_id)
+        if owner_email:
+            # Notify human agents from the batching queue
+            notification_queue.enqueue_handoff(handoff, owner_email, lead)
         
         return handoff
     except HTTPException:
@@ -298,26 +403,26 @@ async def get_pending_handoffs(
 ):
     """Get pending handoff requests for user's agents"""
     try:
-        # Get user's agents
-        user_agents = await db.execute(
-            select(Agent.id).where(Agent.user_id == current_user.id)
-        )
-        agent_ids = [a[0] for a in user_agents]
-        
-        # Get pending handoffs
+        # Get pending handoffs for the user's agents as plain rows. If the response
+        # grows nested relationships, select the entity again and eager-load them
+        # (selectinload) so serializing the list never lazy-loads per row.
+        user_id = current_user.id
         result = await db.execute(
-            select(HandoffRequest)
-            .where(
-                and_(
-                    HandoffRequest.agent_id.in_(agent_ids),
-                    HandoffRequest.status == HandoffStatus.PENDING
+            lambda_stmt(
+                lambda: select(*_HANDOFF_RESPONSE_COLUMNS)
+                .where(
+                    and_(
+                        HandoffRequest.agent_id.in_(
+                            select(Agent.id).where(Agent.user_id == user_id).scalar_subquery()
+                        ),
+                        HandoffRequest.status == HandoffStatus.PENDING
+                    )
                 )
+                .order_by(HandoffRequest.priority_rank.desc(), HandoffRequest.created_at)
             )
-            .order_by(HandoffRequest.created_at)
         )
         
-        handoffs = result.scalars().all()
-        return handoffs
+        return _json_list(_HANDOFF_LIST, result.all())
     except Exception as e:
         logger.error(f"Error fetching handoff requests: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -326,8 +431,8 @@ async def get_pending_handoffs(
 # Lead form configuration
 @router.post("/forms", response_model=Dict[str, str])
 async def create_lead_form(
-    agent_id: str,
     form_config: LeadFormConfig,
+    agent_id: str = Query(pattern=UUID_PATTERN),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -359,12 +464,18 @@ async def create_lead_form(
             # Create new form
             form = LeadForm(
                 agent_id=agent_id,
-                **form_config.dict()
+                **form_config.model_dump()
             )
             db.add(form)
         
         await db.commit()
-        await db.refresh(form)
+        
+        # Widgets pick up the new configuration on their next load
+        if redis_client:
+            try:
+                await redis_client.delete(_lead_forms_cache_key(agent_id))
+            except Exception as e:
+                logger.warning(f"Failed to invalidate lead forms cache: {e}")
         
         return {"message": "Lead form configured successfully", "form_id": form.id}
     except HTTPException:
@@ -376,23 +487,34 @@ async def create_lead_form(
 
 @router.get("/forms/{agent_id}")
 async def get_agent_lead_forms(
-    agent_id: str,
+    agent_id: str = Path(pattern=UUID_PATTERN),
     db: AsyncSession = Depends(get_db)
 ):
     """Get lead forms for an agent (public endpoint for widget)"""
+    cache_key = _lead_forms_cache_key(agent_id)
+    if redis_client:
+        try:
+            cached = await redis_client.get(cache_key)
+            if cached:
+                return Response(content=cached, media_type="application/json")
+        except Exception as e:
+            logger.warning(f"Lead forms cache read failed: {e}")
+    
     try:
         result = await db.execute(
-            select(LeadForm)
-            .where(
-                and_(
-                    LeadForm.agent_id == agent_id,
-                    LeadForm.is_active == True
+            lambda_stmt(
+                lambda: select(LeadForm)
+                .where(
+                    and_(
+                        LeadForm.agent_id == agent_id,
+                        LeadForm.is_active == True
+                    )
                 )
             )
         )
         forms = result.scalars().all()
         
-        return {
+        body = orjson.dumps({
             "forms": [
                 {
                     "id": form.id,
@@ -403,13 +525,39 @@ async def get_agent_lead_forms(
                 }
                 for form in forms
             ]
-        }
+        })
     except Exception as e:
         logger.error(f"Error fetching lead forms: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if redis_client:
+        try:
+            await redis_client.setex(cache_key, LEAD_FORMS_CACHE_TTL, body)
+        except Exception as e:
+            logger.warning(f"Lead forms cache write failed: {e}")
+    
+    return Response(content=body, media_type="application/json")
 
 
 # Analytics endpoints
+# Built once at import: per-status counts as FILTERed aggregates, no GROUP BY
+_LEAD_ANALYTICS_STMT = (
+    select(
+        func.count().label("total"),
+        *[func.count().filter(Lead.status == status).label(status.value) for status in LeadStatus],
+        func.avg(Lead.score).label("avg_score")
+    )
+    .where(
+        and_(
+            Lead.agent_id.in_(
+                select(Agent.id).where(Agent.user_id == bindparam("user_id")).scalar_subquery()
+            ),
+            Lead.created_at >= bindparam("start_date")
+        )
+    )
+)
+
+
 @router.get("/analytics/summary")
 async def get_lead_analytics(
     days: int = 30,
@@ -421,50 +569,17 @@ async def get_lead_analytics(
         from datetime import timedelta
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # Get user's agents
-        user_agents = await db.execute(
-            select(Agent.id).where(Agent.user_id == current_user.id)
-        )
-        agent_ids = [a[0] for a in user_agents]
-        
-        # Get lead statistics
-        total_leads = await db.execute(
-            select(func.count(Lead.id))
-            .where(
-                and_(
-                    Lead.agent_id.in_(agent_ids),
-                    Lead.created_at >= start_date
-                )
-            )
-        )
-        
-        leads_by_status = await db.execute(
-            select(Lead.status, func.count(Lead.id))
-            .where(
-                and_(
-                    Lead.agent_id.in_(agent_ids),
-                    Lead.created_at >= start_date
-                )
-            )
-            .group_by(Lead.status)
-        )
-        
-        avg_score = await db.execute(
-            select(func.avg(Lead.score))
-            .where(
-                and_(
-                    Lead.agent_id.in_(agent_ids),
-                    Lead.created_at >= start_date
-                )
-            )
+        # Every metric is a column of a single aggregate row
+        result = await db.execute(
+            _LEAD_ANALYTICS_STMT,
+            {"user_id": current_user.id, "start_date": start_date}
         )
+        row = result.one()._mapping
         
         return {
-            "total_leads": total_leads.scalar() or 0,
-            "leads_by_status": {
-                status.value: count for status, count in leads_by_status
-            },
-            "average_score": float(avg_score.scalar() or 0),
+            "total_leads": row["total"],
+            "leads_by_status": {status.value: row[status.value] for status in LeadStatus},
+            "average_score": float(row["avg_score"] or 0),
             "period_days": days
         }
     except Exception as e:
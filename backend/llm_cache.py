@@ -0,0 +1,151 @@
+"""
+Caches around LLM completions.
+Responses are matched by exact prompt or, within one agent and retrieved context, by
+similarity of the user's question; per-agent system prompts are kept in Redis.
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+import logging
+
+import numpy as np
+import xxhash
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+EXACT_CACHE_SIZE = 10_000
+EXACT_CACHE_TTL = 3600  # seconds
+SEMANTIC_CACHE_SIZE = 1000
+SIMILARITY_THRESHOLD = 0.95
+MAX_CACHEABLE_TEMPERATURE = 0.3
+PREFIX_CACHE_TTL = 900  # seconds
+
+
+def is_deterministic(kwargs: Dict[str, Any]) -> bool:
+    """Only explicitly low-temperature completions are reused; providers sample at 0.7 by default"""
+    temperature = kwargs.get('temperature')
+    return temperature is not None and temperature <= MAX_CACHEABLE_TEMPERATURE
+
+
+def prompt_key(prompt: str, kwargs: Dict[str, Any]) -> str:
+    """Stable hash of a prompt and its completion options"""
+    payload = prompt.encode('utf-8') + json.dumps(kwargs, sort_keys=True, default=str).encode('utf-8')
+    return xxhash.xxh3_128_hexdigest(payload)
+
+
+def response_scope(agent_id: str, *parts: str) -> str:
+    """Semantic cache scope: one agent plus everything in the prompt except the question"""
+    return f"{agent_id}:{xxhash.xxh3_128_hexdigest(chr(0).join(parts).encode('utf-8'))}"
+
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) + 1e-9)
+
+
+class LLMResponseCache:
+    """Caches completions by exact prompt and by cosine similarity of question embeddings"""
+
+    def __init__(
+        self,
+        maxsize: int = EXACT_CACHE_SIZE,
+        ttl: int = EXACT_CACHE_TTL,
+        semantic_size: int = SEMANTIC_CACHE_SIZE,
+        threshold: float = SIMILARITY_THRESHOLD
+    ):
+        self.exact: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.semantic_size = semantic_size
+        self.threshold = threshold
+        # Ring buffer of unit-normalized question embeddings and their scopes,
+        # allocated once the dimension is known
+        self._vectors: Optional[np.ndarray] = None
+        self._scopes = np.full(semantic_size, None, dtype=object)
+        self._responses: List[Optional[str]] = [None] * semantic_size
+        self._count = 0
+        self._next = 0
+
+    def get(
+        self,
+        prompt: str,
+        kwargs: Dict[str, Any],
+        scope: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Optional[str]:
+        """Exact match first; the semantic tier is only searched within the given scope"""
+        response = self.exact.get(prompt_key(prompt, kwargs))
+        if response is not None or scope is None or query_embedding is None or not self._count:
+            return response
+
+        vector = _unit(query_embedding)
+        if vector.shape[0] != self._vectors.shape[1]:
+            return None
+
+        candidates = np.flatnonzero(self._scopes[:self._count] == scope)
+        if not candidates.size:
+            return None
+
+        # Stored vectors are unit length, so one matrix-vector product gives every cosine similarity
+        scores = self._vectors[candidates] @ vector
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return self._responses[candidates[best]]
+        return None
+
+    def put(
+        self,
+        prompt: str,
+        kwargs: Dict[str, Any],
+        response: str,
+        scope: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None
+    ):
+        """Store a completion in the exact tier and, when scoped, the semantic tier"""
+        self.exact[prompt_key(prompt, kwargs)] = response
+        if scope is None or query_embedding is None:
+            return
+
+        vector = _unit(query_embedding)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.semantic_size, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self._vectors.shape[1]:
+            return
+
+        self._vectors[self._next] = vector
+        self._scopes[self._next] = scope
+        self._responses[self._next] = response
+        self._next = (self._next + 1) % self.semantic_size
+        self._count = min(self._count + 1, self.semantic_size)
+
+
+class PrefixCache:
+    """Rendered per-agent system prompts in Redis, so chat turns skip reloading the agent"""
+
+    def __init__(self, redis_client, ttl: int = PREFIX_CACHE_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(agent_id: str) -> str:
+        return f"prompt_prefix:{agent_id}"
+
+    async def get(self, agent_id: str) -> Optional[str]:
+        try:
+            cached = await self.redis_client.get(self._key(agent_id))
+        except Exception as e:
+            logger.warning(f"Prompt prefix cache read failed: {e}")
+            return None
+        return cached.decode('utf-8') if cached is not None else None
+
+    async def set(self, agent_id: str, prefix: str):
+        try:
+            await self.redis_client.setex(self._key(agent_id), self.ttl, prefix)
+        except Exception as e:
+            logger.warning(f"Prompt prefix cache write failed: {e}")
+
+    async def invalidate(self, agent_id: str):
+        """Drop an agent's cached prefix after its configuration changes"""
+        try:
+            await self.redis_client.delete(self._key(agent_id))
+        except Exception as e:
+            logger.warning(f"Prompt prefix cache invalidation failed: {e}")
@@ -3,21 +3,79 @@ Multi-LLM Provider Support for NETVEXA
 Supports: Anthropic (Claude), Google (Gemini), OpenAI (GPT)
 """
 
+import functools
 import logging
 from abc import ABC, abstractmethod
+from types import MappingProxyType
 from typing import List, Dict, Any, Optional, AsyncGenerator
 import asyncio
+import httpx
 
 # Provider specific imports
 import anthropic
 import google.generativeai as genai
+import openai
+from google.api_core import exceptions as google_exceptions
 from openai import AsyncOpenAI
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_delay, wait_random_exponential
 
 from config import settings, LLMProvider
+from llm_cache import LLMResponseCache, is_deterministic, prompt_key
 
 logger = logging.getLogger(__name__)
 
+# Context windows for different Claude models
+ANTHROPIC_CONTEXT_WINDOWS = MappingProxyType({
+    "claude-3-opus-20240229": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "claude-3-haiku-20240307": 200000,
+    "claude-2.1": 200000,
+    "claude-2.0": 100000,
+})
+
+# Context windows for Gemini models
+GOOGLE_CONTEXT_WINDOWS = MappingProxyType({
+    "gemini-1.5-flash": 1048576,  # 1M tokens
+    "gemini-1.5-pro": 1048576,  # 1M tokens
+    "gemini-pro": 32768,
+    "gemini-pro-vision": 16384,
+})
+
+# Context windows for OpenAI models
+OPENAI_CONTEXT_WINDOWS = MappingProxyType({
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo-preview": 128000,
+    "gpt-3.5-turbo": 16384,
+    "gpt-3.5-turbo-16k": 16384,
+})
+
+# Transient failures worth retrying; bad requests and auth errors fail immediately
+RETRYABLE_ERRORS = (
+    anthropic.RateLimitError, anthropic.APITimeoutError,
+    anthropic.APIConnectionError, anthropic.InternalServerError,
+    openai.RateLimitError, openai.APITimeoutError,
+    openai.APIConnectionError, openai.InternalServerError,
+    google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded, google_exceptions.InternalServerError,
+    httpx.TransportError,
+)
+
+# Jittered backoff so concurrent callers don't retry in lockstep, capped at 20s overall
+retry_transient = retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=wait_random_exponential(min=0.5, max=8),
+    stop=stop_after_delay(20),
+    reraise=True
+)
+
+# Shared HTTP/2 client so completions reuse warm connections instead of a pool per SDK client
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60),
+    timeout=httpx.Timeout(60.0, connect=5.0)
+)
+
 class BaseLLMProvider(ABC):
     """Abstract base class for LLM providers"""
     
@@ -35,15 +93,25 @@ class BaseLLMProvider(ABC):
     def get_context_window(self) -> int:
         """Get the maximum context window size for the model"""
         pass
+    
+    async def batch_complete(self, prompts: List[str], concurrency: int = 10, **kwargs) -> List[str]:
+        """Complete many prompts concurrently, at most `concurrency` requests in flight"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def complete_one(prompt: str) -> str:
+            async with semaphore:
+                return await self.complete(prompt, **kwargs)
+        
+        return await asyncio.gather(*(complete_one(prompt) for prompt in prompts))
 
 class AnthropicProvider(BaseLLMProvider):
     """Anthropic Claude provider"""
     
     def __init__(self, api_key: str, model: str):
-        self.client = anthropic.AsyncAnthropic(api_key=api_key)
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, http_client=_http_client)
         self.model = model
         
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
+    @retry_transient
     async def complete(self, prompt: str, **kwargs) -> str:
         try:
             # Create the client method correctly
@@ -83,15 +151,7 @@ class AnthropicProvider(BaseLLMProvider):
             raise
     
     def get_context_window(self) -> int:
-        # Context windows for different Claude models
-        context_windows = {
-            "claude-3-opus-20240229": 200000,
-            "claude-3-sonnet-20240229": 200000,
-            "claude-3-haiku-20240307": 200000,
-            "claude-2.1": 200000,
-            "claude-2.0": 100000,
-        }
-        return context_windows.get(self.model, 100000)
+        return ANTHROPIC_CONTEXT_WINDOWS.get(self.model, 100000)
 
 class GoogleProvider(BaseLLMProvider):
     """Google Gemini provider"""
@@ -101,20 +161,18 @@ class GoogleProvider(BaseLLMProvider):
         self.model = genai.GenerativeModel(model)
         self.model_name = model
         
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
+    def _generation_config(self, **kwargs) -> genai.types.GenerationConfig:
+        return genai.types.GenerationConfig(
+            max_output_tokens=kwargs.get('max_tokens', 1024),
+            temperature=kwargs.get('temperature', 0.7),
+        )
+    
+    @retry_transient
     async def complete(self, prompt: str, **kwargs) -> str:
         try:
-            # Google's API is synchronous, so we run it in an executor
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=kwargs.get('max_tokens', 1024),
-                        temperature=kwargs.get('temperature', 0.7),
-                    )
-                )
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config(**kwargs)
             )
             return response.text
         except Exception as e:
@@ -123,21 +181,13 @@ class GoogleProvider(BaseLLMProvider):
     
     async def stream_complete(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
         try:
-            # Google's streaming is synchronous, so we handle it differently
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=kwargs.get('max_tokens', 1024),
-                        temperature=kwargs.get('temperature', 0.7),
-                    ),
-                    stream=True
-                )
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config(**kwargs),
+                stream=True
             )
             
-            for chunk in response:
+            async for chunk in response:
                 if chunk.text:
                     yield chunk.text
                     
@@ -146,23 +196,16 @@ class GoogleProvider(BaseLLMProvider):
             raise
     
     def get_context_window(self) -> int:
-        # Context windows for Gemini models
-        context_windows = {
-            "gemini-1.5-flash": 1048576,  # 1M tokens
-            "gemini-1.5-pro": 1048576,  # 1M tokens
-            "gemini-pro": 32768,
-            "gemini-pro-vision": 16384,
-        }
-        return context_windows.get(self.model_name, 32768)
+        return GOOGLE_CONTEXT_WINDOWS.get(self.model_name, 32768)
 
 class OpenAIProvider(BaseLLMProvider):
     """OpenAI GPT provider"""
     
     def __init__(self, api_key: str, model: str):
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = AsyncOpenAI(api_key=api_key, http_client=_http_client)
         self.model = model
         
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
+    @retry_transient
     async def complete(self, prompt: str, **kwargs) -> str:
         try:
             response = await self.client.chat.completions.create(
@@ -201,20 +244,13 @@ class OpenAIProvider(BaseLLMProvider):
             raise
     
     def get_context_window(self) -> int:
-        # Context windows for OpenAI models
-        context_windows = {
-            "gpt-4": 8192,
-            "gpt-4-32k": 32768,
-            "gpt-4-turbo-preview": 128000,
-            "gpt-3.5-turbo": 16384,
-            "gpt-3.5-turbo-16k": 16384,
-        }
-        return context_windows.get(self.model, 4096)
+        return OPENAI_CONTEXT_WINDOWS.get(self.model, 4096)
 
 class LLMProviderFactory:
     """Factory class to create LLM providers"""
     
     @staticmethod
+    @functools.lru_cache(maxsize=8)
     def create_provider(
         provider_type: Optional[LLMProvider] = None,
         api_key: Optional[str] = None,
@@ -256,6 +292,7 @@ class LLMProviderFactory:
             raise ValueError(f"Unknown provider type: {provider_type}")
     
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def get_available_providers() -> List[LLMProvider]:
         """Get list of providers that have API keys configured"""
         available = []
@@ -277,6 +314,9 @@ class LLMProviderWithFallback:
     def __init__(self):
         self.primary_provider = None
         self.fallback_providers = []
+        self.cache = LLMResponseCache() if settings.ENABLE_CACHE else None
+        # Completions in progress by prompt key, awaited by duplicate callers
+        self._inflight: Dict[str, asyncio.Future] = {}
         self._initialize_providers()
     
     def _initialize_providers(self):
@@ -303,10 +343,66 @@ class LLMProviderWithFallback:
                 except Exception as e:
                     logger.error(f"Failed to initialize fallback provider {provider}: {e}")
     
-    async def complete(self, prompt: str, **kwargs) -> str:
-        """Complete with automatic fallback"""
-        # Try primary provider
+    async def complete(
+        self,
+        prompt: str,
+        cache_scope: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+        **kwargs
+    ) -> str:
+        """Complete with automatic fallback, serving repeated prompts from the response cache"""
+        # cache_scope (llm_cache.response_scope) and the question's embedding let a paraphrased
+        # question reuse an answer given for the same agent, retrieved context and history
+        if not is_deterministic(kwargs):
+            return await self._complete_uncached(prompt, **kwargs)
+        
+        # Identical concurrent prompts share one provider call. The work runs in its own
+        # task so a disconnecting first caller doesn't cancel it for everyone else.
+        key = prompt_key(prompt, kwargs)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                self._complete_cached(prompt, cache_scope, query_embedding, **kwargs)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def _complete_cached(
+        self,
+        prompt: str,
+        cache_scope: Optional[str],
+        query_embedding: Optional[List[float]],
+        **kwargs
+    ) -> str:
+        if self.cache is None:
+            return await self._complete_uncached(prompt, **kwargs)
+        
+        cached = self.cache.get(prompt, kwargs, cache_scope, query_embedding)
+        if cached is not None:
+            return cached
+        
+        response = await self._complete_uncached(prompt, **kwargs)
+        self.cache.put(prompt, kwargs, response, cache_scope, query_embedding)
+        return response
+    
+    async def batch_complete(self, prompts: List[str], concurrency: int = 10, **kwargs) -> List[str]:
+        """Complete many prompts concurrently, each with caching and fallback"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def complete_one(prompt: str) -> str:
+            async with semaphore:
+                return await self.complete(prompt, **kwargs)
+        
+        return await asyncio.gather(*(complete_one(prompt) for prompt in prompts))
+    
+    async def _complete_uncached(self, prompt: str, **kwargs) -> str:
+        hedged = settings.ENABLE_FALLBACK and settings.HEDGE_FALLBACK_MS > 0 and bool(self.fallback_providers)
+        
+        # Try primary provider, racing the first fallback against it when hedging is on
         try:
+            if hedged:
+                return await self._hedged_complete(prompt, **kwargs)
             return await self.primary_provider.complete(prompt, **kwargs)
         except Exception as e:
             logger.error(f"Primary provider failed: {e}")
@@ -314,8 +410,8 @@ class LLMProviderWithFallback:
             if not settings.ENABLE_FALLBACK:
                 raise
             
-            # Try fallback providers
-            for provider in self.fallback_providers:
+            # Try fallback providers, skipping the one the hedge already raced
+            for provider in self.fallback_providers[1 if hedged else 0:]:
                 try:
                     logger.info(f"Attempting fallback to {provider.__class__.__name__}")
                     return await provider.complete(prompt, **kwargs)
@@ -326,12 +422,114 @@ class LLMProviderWithFallback:
             # All providers failed
             raise Exception("All LLM providers failed")
     
-    async def stream_complete(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
-        """Stream complete with automatic fallback"""
-        # For streaming, we don't do fallback mid-stream
+    async def _hedged_complete(self, prompt: str, **kwargs) -> str:
+        """Give the primary a head start, then race it against the first fallback"""
+        primary = asyncio.create_task(self.primary_provider.complete(prompt, **kwargs))
+        pending = {primary}
         try:
-            async for chunk in self.primary_provider.stream_complete(prompt, **kwargs):
+            done, pending = await asyncio.wait(pending, timeout=settings.HEDGE_FALLBACK_MS / 1000)
+            error = None
+            if done:
+                if primary.exception() is None:
+                    return primary.result()
+                error = primary.exception()
+                logger.error(f"Primary provider failed: {error}")
+            
+            # The first fallback starts now whether the primary is slow or already failed
+            hedge_provider = self.fallback_providers[0]
+            logger.info(f"Hedging with {hedge_provider.__class__.__name__}")
+            pending.add(asyncio.create_task(hedge_provider.complete(prompt, **kwargs)))
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Losers are cancelled so a late answer doesn't keep a connection busy
+            for task in pending:
+                task.cancel()
+    
+    async def stream_complete(
+        self,
+        prompt: str,
+        cache_scope: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """Stream complete with automatic fallback; cached or in-flight answers arrive as one chunk"""
+        if not is_deterministic(kwargs):
+            async for chunk in self._stream_uncached(prompt, **kwargs):
                 yield chunk
-        except Exception as e:
-            logger.error(f"Primary provider streaming failed: {e}")
-            raise
\ No newline at end of file
+            return
+        
+        if self.cache is not None:
+            cached = self.cache.get(prompt, kwargs, cache_scope, query_embedding)
+            if cached is not None:
+                yield cached
+                return
+        
+        # Share an identical prompt that is already being answered, or lead it for later callers
+        key = prompt_key(prompt, kwargs)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                response = await asyncio.shield(inflight)
+            except Exception:
+                response = None  # The other caller failed; answer this one ourselves
+            if response is not None:
+                yield response
+                return
+        
+        leader = asyncio.get_running_loop().create_future()
+        if key not in self._inflight:
+            self._inflight[key] = leader
+            leader.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        chunks = []
+        try:
+            async for chunk in self._stream_uncached(prompt, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            response = "".join(chunks)
+            leader.set_result(response)
+            if self.cache is not None:
+                self.cache.put(prompt, kwargs, response, cache_scope, query_embedding)
+        finally:
+            if not leader.done():
+                # Failed or abandoned by its consumer; waiting callers stream for themselves
+                leader.set_exception(Exception("Streaming completion did not finish"))
+                leader.exception()
+    
+    async def _stream_uncached(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        providers = [self.primary_provider]
+        if settings.ENABLE_FALLBACK:
+            providers += self.fallback_providers
+        
+        for provider in providers:
+            started = False
+            try:
+                async for chunk in provider.stream_complete(prompt, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # Text already sent can't be taken back, so only a failure before
+                # the first chunk moves on to the next provider
+                if started:
+                    raise
+                logger.error(f"{provider.__class__.__name__} streaming failed: {e}")
+        
+        # All providers failed
+        raise Exception("All LLM providers failed")
+
+@functools.lru_cache(maxsize=None)
+def get_llm_provider() -> LLMProviderWithFallback:
+    """Process-wide LLM provider with fallback, built on first use"""
+    return LLMProviderWithFallback()
+
+async def close_llm_http_client():
+    """Close the shared LLM HTTP client's pooled connections"""
+    await _http_client.aclose()
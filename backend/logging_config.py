@@ -1,8 +1,12 @@
 import logging
 import logging.handlers
 import os
+import queue
 from datetime import datetime
 
+# Background thread that writes queued records to the real handlers
+_listener = None
+
 def setup_logging(app_name="netvexa"):
     """Configure logging with both file and console output"""
     
@@ -37,11 +41,23 @@ def setup_logging(app_name="netvexa"):
     )
     file_handler.setFormatter(file_formatter)
     
-    # Add handlers
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # Callers only enqueue records; formatting and disk/console I/O happen on the listener thread
+    global _listener
+    log_queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
     
     # Log startup
     logger.info(f"Logging initialized. Log file: {log_file}")
     
-    return logger
\ No newline at end of file
+    return logger
+
+def stop_logging():
+    """Flush queued log records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,19 +1,28 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request, Response, Path, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import BaseModel
 from typing import Dict, List, Optional
-import json
 import asyncio
+import uuid
+import orjson
 from datetime import datetime
 import logging
 
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+
 from config import settings
-from rag import ProductionRAGEngine
-from models import ChatMessage, ChatResponse, AgentConfig
-from database import init_db, get_db, Agent, Conversation as DBConversation, Message as DBMessage
+from rag import get_rag_engine
+from models import ChatMessage, ChatResponse, AgentConfig, UUID_PATTERN
+from database import init_db, async_session, Agent, Conversation as DBConversation, Message as DBMessage
 from websocket_manager import ConnectionManager
+from bulk_writer import bulk_writer
+from notification_queue import notification_queue
+from embedding_providers import warm_http_client, close_http_client
+from llm_providers import close_llm_http_client
 from metrics import metrics_tracker, track_conversation_started, track_lead_captured
 from auth_routes import router as auth_router
 from agent_routes import router as agent_router
@@ -22,14 +31,16 @@ from knowledge_routes import router as knowledge_router
 from conversation_routes import router as conversation_router
 from lead_routes import router as lead_router
 from billing_middleware import billing_middleware
+from billing_service import BillingService
 from quick_reply_engine import QuickReplyEngine, ConversationStage
+from business_templates import BusinessTemplates, BusinessScenario
 
 # Configure logging
-from logging_config import setup_logging
+from logging_config import setup_logging, stop_logging
 logger = setup_logging("netvexa-backend")
 
 # Initialize FastAPI app
-app = FastAPI(title="NETVEXA MVP", version="0.1.0")
+app = FastAPI(title="NETVEXA MVP", version="0.1.0", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -47,7 +58,7 @@ app.add_middleware(BaseHTTPMiddleware, dispatch=billing_middleware)
 manager = ConnectionManager()
 
 # Initialize RAG engine
-rag_engine = ProductionRAGEngine()
+rag_engine = get_rag_engine()
 
 # Initialize Quick Reply engine
 quick_reply_engine = QuickReplyEngine()
@@ -67,8 +78,20 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 async def startup_event():
     """Initialize database and other resources on startup"""
     await init_db()
+    bulk_writer.start()
+    notification_queue.start()
+    await warm_http_client()
     logger.info("NETVEXA MVP started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered writes and close pooled connections before shutdown"""
+    await bulk_writer.stop()
+    await notification_queue.stop()
+    await close_http_client()
+    await close_llm_http_client()
+    stop_logging()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -77,8 +100,8 @@ async def root():
 
 @app.get("/api/quick-replies/{agent_id}")
 async def get_quick_replies(
-    agent_id: str,
-    conversation_id: Optional[str] = None,
+    agent_id: str = Path(pattern=UUID_PATTERN),
+    conversation_id: Optional[str] = Query(None, pattern=UUID_PATTERN),
     stage: Optional[str] = None
 ):
     """Get intelligent quick replies for conversation"""
@@ -86,8 +109,7 @@ async def get_quick_replies(
         # Get conversation history if conversation_id provided
         conversation_history = []
         if conversation_id:
-            async for db in get_db():
-                from sqlalchemy import select, and_
+            async with async_session() as db:
                 result = await db.execute(
                     select(DBMessage)
                     .where(DBMessage.conversation_id == conversation_id)
@@ -103,7 +125,6 @@ async def get_quick_replies(
                     }
                     for msg in messages
                 ]
-                break
         
         # User context (basic for now)
         user_context = {
@@ -146,126 +167,134 @@ async def get_quick_replies(
             "context": {}
         }
 
+@app.get("/api/templates/{scenario}")
+async def get_business_template(scenario: BusinessScenario, request: Request):
+    """Get a business content template (immutable, safe to cache upstream)"""
+    body, etag = BusinessTemplates.get_template_json(scenario)
+    headers = {
+        "Cache-Control": "public, max-age=86400, immutable",
+        "ETag": etag
+    }
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def send_ws_json(websocket: WebSocket, payload: dict):
+    """Send a JSON text frame serialized with orjson; datetimes are written as ISO 8601"""
+    await websocket.send_text(orjson.dumps(payload).decode())
+
 @app.websocket("/ws/{agent_id}")
-async def websocket_endpoint(websocket: WebSocket, agent_id: str):
+async def websocket_endpoint(websocket: WebSocket, agent_id: str = Path(pattern=UUID_PATTERN)):
     """WebSocket endpoint for real-time chat"""
     await manager.connect(websocket, agent_id)
     
     # Create conversation in database
-    visitor_id = f"visitor_{datetime.utcnow().timestamp()}"
+    visitor_id = f"visitor_{uuid.uuid4().hex}"
     conversation_id = None
     
-    async for db in get_db():
-        conversation = DBConversation(
-            agent_id=agent_id,
-            visitor_id=visitor_id,
-            started_at=datetime.utcnow(),
-            meta_data={"source": "websocket"}
-        )
-        db.add(conversation)
+    # Create the conversation and fetch the agent's user_id for billing in one statement
+    async with async_session() as db:
+        try:
+            result = await db.execute(
+                insert(DBConversation)
+                .values(
+                    agent_id=agent_id,
+                    visitor_id=visitor_id,
+                    started_at=datetime.utcnow(),
+                    source="websocket"
+                )
+                .returning(
+                    DBConversation.id,
+                    select(Agent.user_id).where(Agent.id == agent_id).scalar_subquery()
+                )
+            )
+        except IntegrityError:
+            # No such agent
+            manager.disconnect(websocket, agent_id)
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        conversation_id, user_id = result.one()
         await db.commit()
-        await db.refresh(conversation)
-        conversation_id = conversation.id
-        break
     
     await track_conversation_started(agent_id, visitor_id)
     
-    # Get agent's user_id for billing
-    from sqlalchemy import select
-    user_id = None
-    async for db in get_db():
-        result = await db.execute(
-            select(Agent).where(Agent.id == agent_id)
-        )
-        agent = result.scalar_one_or_none()
-        if agent:
-            user_id = agent.user_id
-        break
+    # Warm query embeddings before the visitor's first message arrives
+    rag_engine.schedule_query_prefetch(agent_id)
     
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = orjson.loads(data)
+            received_at = datetime.utcnow()
             
             # Create chat message
             chat_message = ChatMessage(
                 content=message["content"],
-                conversation_id=conversation_id or message.get("conversation_id", f"conv_{agent_id}_{datetime.now().timestamp()}"),
+                conversation_id=conversation_id or message.get("conversation_id") or f"conv_{agent_id}_{received_at.timestamp()}",
                 sender="user",
-                timestamp=datetime.now()
+                timestamp=received_at
             )
             
             # Store message in database
-            async for db in get_db():
-                db_message = DBMessage(
-                    conversation_id=conversation_id,
-                    sender="user",
-                    content=message["content"],
-                    timestamp=datetime.utcnow()
-                )
-                db.add(db_message)
-                await db.commit()
-                break
+            await bulk_writer.enqueue({
+                "conversation_id": conversation_id,
+                "sender": "user",
+                "content": message["content"],
+                "timestamp": received_at
+            })
             
-            # Check message limits if we have user_id
+            # Check the message limit and count this message in one statement
             if user_id:
-                from billing_service import BillingService
-                async for db in get_db():
-                    can_send = await BillingService.check_usage_limits(
-                        user_id, "message", db
-                    )
-                    if not can_send:
-                        await websocket.send_json({
-                            "type": "error",
-                            "content": "Message limit reached. Please upgrade your subscription.",
-                            "timestamp": datetime.now().isoformat()
-                        })
-                        break
-                    break
+                async with async_session() as db:
+                    can_send = await BillingService.consume_message_quota(user_id, db)
+                
+                if not can_send:
+                    await send_ws_json(websocket, {
+                        "type": "error",
+                        "content": "Message limit reached. Please upgrade your subscription.",
+                        "timestamp": received_at
+                    })
+                    continue
             
             # Get conversation history
             conversation_history = await rag_engine.get_conversation_history(
                 agent_id, chat_message.conversation_id
             )
             
+            # Stream text to the client as it is generated; the final "message"
+            # frame below still carries the complete rich response
+            async def send_token(chunk: str):
+                await send_ws_json(websocket, {"type": "token", "content": chunk})
+            
             # Process message through production RAG engine
             response = await rag_engine.generate_response(
                 message=chat_message,
                 agent_id=agent_id,
-                conversation_history=conversation_history
+                conversation_history=conversation_history,
+                on_token=send_token
             )
             
-            # Track message usage
-            if user_id:
-                async for db in get_db():
-                    await BillingService.track_usage(
-                        user_id, "message", db, 1
-                    )
-                    break
-            
             # Store agent response in database
-            async for db in get_db():
-                # Handle rich content - serialize to JSON string for storage
-                content_to_store = response.content
-                if isinstance(response.content, dict):
-                    content_to_store = json.dumps(response.content)
-                
-                agent_message = DBMessage(
-                    conversation_id=conversation_id,
-                    sender="agent",
-                    content=content_to_store,
-                    timestamp=datetime.utcnow()
-                )
-                db.add(agent_message)
-                await db.commit()
-                break
+            # Handle rich content - serialize to JSON string for storage
+            content_to_store = response.content
+            if isinstance(response.content, dict):
+                content_to_store = orjson.dumps(response.content).decode()
+            
+            await bulk_writer.enqueue({
+                "conversation_id": conversation_id,
+                "sender": "agent",
+                "content": content_to_store,
+                "timestamp": datetime.utcnow()
+            })
             
             # Send response back to client
-            await websocket.send_json({
+            await send_ws_json(websocket, {
                 "type": "message",
                 "content": response.content,
-                "timestamp": response.timestamp.isoformat(),
+                "timestamp": response.timestamp,
                 "sender": "agent"
             })
             
@@ -273,21 +302,19 @@ async def websocket_endpoint(websocket: WebSocket, agent_id: str):
         manager.disconnect(websocket, agent_id)
         # Mark conversation as ended
         if conversation_id:
-            async for db in get_db():
-                result = await db.execute(
-                    select(DBConversation).where(DBConversation.id == conversation_id)
+            async with async_session() as db:
+                await db.execute(
+                    update(DBConversation)
+                    .where(DBConversation.id == conversation_id)
+                    .values(ended_at=datetime.utcnow())
                 )
-                conv = result.scalar_one_or_none()
-                if conv:
-                    conv.ended_at = datetime.utcnow()
-                    await db.commit()
-                break
+                await db.commit()
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         manager.disconnect(websocket, agent_id)
 
 @app.post("/api/chat/message")
-async def send_message(agent_id: str, message: ChatMessage):
+async def send_message(message: ChatMessage, agent_id: str = Query(pattern=UUID_PATTERN)):
     """REST endpoint for sending chat messages (fallback for non-WebSocket clients)"""
     try:
         # Get conversation history
@@ -307,7 +334,7 @@ async def send_message(agent_id: str, message: ChatMessage):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/agents/{agent_id}/config")
-async def get_agent_config(agent_id: str):
+async def get_agent_config(agent_id: str = Path(pattern=UUID_PATTERN)):
     """Get agent configuration"""
     # For MVP, return default config
     return AgentConfig(
@@ -324,14 +351,14 @@ async def get_agent_config(agent_id: str):
 async def get_dashboard_metrics():
     """Get comprehensive dashboard metrics"""
     try:
-        metrics = await metrics_tracker.get_dashboard_metrics()
-        return metrics
+        body = await metrics_tracker.get_dashboard_metrics_json()
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         logger.error(f"Error fetching metrics: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch metrics")
 
 @app.get("/api/metrics/agents/{agent_id}/time-to-value")
-async def get_agent_time_to_value(agent_id: str):
+async def get_agent_time_to_value(agent_id: str = Path(pattern=UUID_PATTERN)):
     """Get time to first value for a specific agent"""
     try:
         ttfv = await metrics_tracker.get_time_to_first_value(agent_id)
@@ -347,7 +374,7 @@ async def get_agent_time_to_value(agent_id: str):
         raise HTTPException(status_code=500, detail="Failed to calculate metric")
 
 @app.get("/api/metrics/conversations/{conversation_id}/quality")
-async def get_conversation_quality(conversation_id: str):
+async def get_conversation_quality(conversation_id: str = Path(pattern=UUID_PATTERN)):
     """Get quality score for a specific conversation"""
     try:
         score = await metrics_tracker.calculate_conversation_quality_score(conversation_id)
@@ -391,7 +418,7 @@ async def get_conversation_trends(days: int = 7):
         raise HTTPException(status_code=500, detail="Failed to fetch trends")
 
 @app.get("/api/metrics/agents/{agent_id}/performance")
-async def get_agent_performance(agent_id: str, days: int = 30):
+async def get_agent_performance(agent_id: str = Path(pattern=UUID_PATTERN), days: int = 30):
     """Get detailed performance metrics for a specific agent"""
     try:
         performance = await metrics_tracker.get_agent_performance(agent_id, days)
@@ -412,4 +439,12 @@ async def get_engagement_patterns():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=settings.HOST, port=settings.PORT, reload=True)
\ No newline at end of file
+    # uvloop and httptools come with uvicorn[standard]; auto-reload is for development only
+    uvicorn.run(
+        "main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        loop="uvloop",
+        http="httptools",
+        reload=settings.ENVIRONMENT == "development"
+    )
\ No newline at end of file
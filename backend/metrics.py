@@ -14,26 +14,47 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from collections import defaultdict
 import asyncio
+import functools
+import logging
+import orjson
+from cachetools import TTLCache
 from sqlalchemy import select, func, and_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import async_session, Agent, Conversation, Message
 
+logger = logging.getLogger(__name__)
+
+# Conversation quality: message count and duration that earn full points
+QUALITY_FULL_ENGAGEMENT_MESSAGES = 10.0
+QUALITY_FULL_DURATION_MINUTES = 15.0
+
+
+def cached_metric(method):
+    """Serve a MetricsTracker result from metrics_cache for cache_ttl seconds, keyed by method and arguments."""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        value = self.metrics_cache.get(key)
+        if value is None:
+            value = await method(self, *args, **kwargs)
+            self.metrics_cache[key] = value
+        return value
+    return wrapper
+
 
 class MetricsTracker:
     """Handles all metrics tracking and analytics."""
     
     def __init__(self):
-        self.metrics_cache = {}
         self.cache_ttl = 300  # 5 minutes
+        self.metrics_cache = TTLCache(maxsize=1024, ttl=self.cache_ttl)
         
     async def track_event(self, event_type: str, data: Dict[str, Any]) -> None:
         """Track a custom event for analytics."""
         # In production, this would send to analytics service
-        # For MVP, we'll store in database
-        async with async_session() as session:
-            # Store event (would need Events table in production)
-            print(f"Event tracked: {event_type} - {data}")
+        # For MVP, we only log it (storing would need an Events table)
+        logger.info(f"Event tracked: {event_type} - {data}")
     
     async def get_time_to_first_value(self, agent_id: str) -> Optional[timedelta]:
         """Calculate time from agent creation to first conversation."""
@@ -68,32 +89,44 @@ class MetricsTracker:
             "avg_time_to_convert_days": 7.2
         }
     
+    @cached_metric
     async def get_weekly_active_agents(self) -> Dict[str, Any]:
         """Get count and list of agents active in the last 7 days."""
         async with async_session() as session:
-            one_week_ago = datetime.utcnow() - timedelta(days=7)
-            
-            # Get agents with conversations in last 7 days
-            active_agents = await session.execute(
-                select(Agent.id, Agent.name, func.count(Conversation.id))
-                .join(Conversation, Agent.id == Conversation.agent_id)
-                .where(Conversation.started_at >= one_week_ago)
-                .group_by(Agent.id, Agent.name)
+            return await self._query_weekly_active_agents(session)
+    
+    async def _query_weekly_active_agents(self, session: AsyncSession) -> Dict[str, Any]:
+        one_week_ago = datetime.utcnow() - timedelta(days=7)
+        
+        # Get agents with conversations in last 7 days, with the overall total as a window sum
+        conversation_count = func.count(Conversation.id)
+        result = await session.execute(
+            select(
+                Agent.id,
+                Agent.name,
+                conversation_count,
+                func.sum(conversation_count).over()
             )
-            
-            agents_data = []
-            for agent_id, agent_name, conv_count in active_agents:
-                agents_data.append({
-                    "agent_id": agent_id,
-                    "agent_name": agent_name,
-                    "conversation_count": conv_count
-                })
-            
-            return {
-                "active_agent_count": len(agents_data),
-                "total_conversations": sum(a["conversation_count"] for a in agents_data),
-                "agents": agents_data
+            .join(Conversation, Agent.id == Conversation.agent_id)
+            .where(Conversation.started_at >= one_week_ago)
+            .group_by(Agent.id, Agent.name)
+        )
+        rows = result.all()
+        
+        agents_data = [
+            {
+                "agent_id": agent_id,
+                "agent_name": agent_name,
+                "conversation_count": conv_count
             }
+            for agent_id, agent_name, conv_count, _ in rows
+        ]
+        
+        return {
+            "active_agent_count": len(agents_data),
+            "total_conversations": int(rows[0][3]) if rows else 0,
+            "agents": agents_data
+        }
     
     async def calculate_conversation_quality_score(self, conversation_id: str) -> float:
         """
@@ -104,27 +137,33 @@ class MetricsTracker:
         - User satisfaction (if available)
         """
         async with async_session() as session:
-            conversation = await session.get(Conversation, conversation_id)
-            if not conversation:
-                return 0.0
-            
-            # Get message count
-            message_count = await session.execute(
-                select(func.count(Message.id))
-                .where(Message.conversation_id == conversation_id)
+            # Conversation fields and its message count in one round trip
+            result = await session.execute(
+                select(
+                    Conversation.started_at,
+                    Conversation.ended_at,
+                    Conversation.lead_id,
+                    select(func.count(Message.id))
+                    .where(Message.conversation_id == Conversation.id)
+                    .scalar_subquery()
+                )
+                .where(Conversation.id == conversation_id)
             )
-            msg_count = message_count.scalar()
+            row = result.one_or_none()
+            if not row:
+                return 0.0
+            started_at, ended_at, lead_id, msg_count = row
             
             # Calculate duration
-            if conversation.ended_at:
-                duration_minutes = (conversation.ended_at - conversation.started_at).total_seconds() / 60
+            if ended_at:
+                duration_minutes = (ended_at - started_at).total_seconds() / 60
             else:
                 duration_minutes = 0
             
             # Score components (weights can be adjusted)
-            engagement_score = min(msg_count / 10, 1.0) * 40  # Max 40 points
-            duration_score = min(duration_minutes / 15, 1.0) * 30  # Max 30 points
-            lead_score = 30 if conversation.lead_id else 0  # 30 points if lead captured
+            engagement_score = min(msg_count / QUALITY_FULL_ENGAGEMENT_MESSAGES, 1.0) * 40  # Max 40 points
+            duration_score = min(duration_minutes / QUALITY_FULL_DURATION_MINUTES, 1.0) * 30  # Max 30 points
+            lead_score = 30 if lead_id else 0  # 30 points if lead captured
             
             total_score = engagement_score + duration_score + lead_score
             return round(total_score, 1)
@@ -187,6 +226,7 @@ class MetricsTracker:
             "average_lifetime_months": 10.0
         }
     
+    @cached_metric
     async def get_revenue_metrics(self) -> Dict[str, Any]:
         """Get comprehensive revenue metrics."""
         return {
@@ -198,16 +238,18 @@ class MetricsTracker:
             "quick_ratio": 3.2  # (New MRR + Expansion) / (Churned + Contraction)
         }
     
+    @cached_metric
     async def get_dashboard_metrics(self) -> Dict[str, Any]:
         """Get all metrics for dashboard display."""
-        # Run all metrics calculations in parallel
-        results = await asyncio.gather(
-            self.get_weekly_active_agents(),
-            self.get_activation_rate(),
-            self.get_acquisition_cost_by_channel(),
-            self.get_churn_rate_by_cohort(3),
-            self.get_revenue_metrics()
-        )
+        # One session serves every DB-backed metric; the rest are simulated
+        async with async_session() as session:
+            results = await asyncio.gather(
+                self._query_weekly_active_agents(session),
+                self.get_activation_rate(),
+                self.get_acquisition_cost_by_channel(),
+                self.get_churn_rate_by_cohort(3),
+                self.get_revenue_metrics()
+            )
         
         return {
             "weekly_active_agents": results[0],
@@ -218,6 +260,12 @@ class MetricsTracker:
             "generated_at": datetime.utcnow().isoformat()
         }
     
+    @cached_metric
+    async def get_dashboard_metrics_json(self) -> bytes:
+        """Dashboard metrics pre-serialized to JSON, so cache hits skip encoding."""
+        return orjson.dumps(await self.get_dashboard_metrics())
+    
+    @cached_metric
     async def get_conversation_trends(self, days: int = 7) -> Dict[str, Any]:
         """Get conversation trends over specified period."""
         async with async_session() as session:
@@ -268,6 +316,7 @@ class MetricsTracker:
                 'period_days': days
             }
     
+    @cached_metric
     async def get_agent_performance(self, agent_id: str, days: int = 30) -> Dict[str, Any]:
         """Get detailed performance metrics for a specific agent."""
         async with async_session() as session:
@@ -331,6 +380,7 @@ class MetricsTracker:
                 }
             }
     
+    @cached_metric
     async def get_engagement_patterns(self) -> Dict[str, Any]:
         """Get user engagement patterns and peak usage times."""
         async with async_session() as session:
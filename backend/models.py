@@ -3,6 +3,10 @@ from datetime import datetime
 from typing import Optional, Dict, List, Any, Union
 from enum import Enum
 
+# Ids of uuid columns taken from paths and query strings; anything else gets a 422
+# instead of failing the database cast
+UUID_PATTERN = r"^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$"
+
 class SenderType(str, Enum):
     USER = "user"
     AGENT = "agent"
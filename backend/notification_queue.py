@@ -0,0 +1,88 @@
+"""
+Coalescing queue for lead and handoff notification emails.
+Request handlers enqueue and return; one worker sends each batch over a single SMTP session.
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
+import logging
+
+from email_service import email_service, smtp_executor
+from lead_models import Lead, HandoffRequest
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 50
+MAX_DELAY = 1.0  # seconds
+
+
+class NotificationQueue:
+    """Buffers notifications and sends them every MAX_BATCH items or MAX_DELAY seconds"""
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background send loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("Notification queue started")
+
+    def enqueue_lead(self, lead: Lead, user_email: str):
+        """Queue a new-lead notification to the agent owner"""
+        self.queue.put_nowait(("lead", user_email, lead))
+
+    def enqueue_handoff(self, handoff: HandoffRequest, user_email: str, lead: Lead):
+        """Queue a human handoff notification to the agent owner"""
+        self.queue.put_nowait(("handoff", user_email, handoff, lead))
+
+    async def stop(self):
+        """Stop the send loop after draining everything already queued"""
+        if self._task is None:
+            return
+
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Notification queue stopped")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first notification, then gather more until the batch or deadline fills
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._send(batch)
+            except Exception as e:
+                logger.error(f"Failed to send {len(batch)} notifications: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _send(self, batch: List[Tuple]):
+        # Rendering and SMTP are blocking; group by recipient so each inbox's mail goes out together
+        batch.sort(key=lambda item: item[1])
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(smtp_executor, email_service.send_queued, batch)
+
+
+# Global notification queue instance
+notification_queue = NotificationQueue()
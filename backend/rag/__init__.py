@@ -1,7 +1,7 @@
 """
 Production RAG module for NETVEXA
 """
-from .production_rag_engine import ProductionRAGEngine, DocumentIngestionResult
+from .production_rag_engine import ProductionRAGEngine, DocumentIngestionResult, get_rag_engine
 from .chunking_strategies import (
     ChunkingStrategy, 
     SentenceChunker, 
@@ -25,6 +25,7 @@ from .hybrid_search import HybridSearchEngine, ReRanker, SearchResult
 __all__ = [
     'ProductionRAGEngine',
     'DocumentIngestionResult',
+    'get_rag_engine',
     'ChunkingStrategy',
     'SentenceChunker',
     'SemanticChunker',
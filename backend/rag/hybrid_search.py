@@ -104,13 +104,14 @@ class HybridSearchEngine:
                            filters: Optional[Dict[str, Any]] = None) -> List[Tuple[KnowledgeDocument, float]]:
         """Perform vector similarity search"""
         try:
-            # Convert embedding to proper format for pgvector
-            from pgvector.sqlalchemy import Vector
+            # Scoring runs inside pgvector (SIMD <=> cosine distance); hand it a
+            # contiguous float32 vector rather than a list of Python floats
+            query_vector = np.ascontiguousarray(query_embedding, dtype=np.float32)
             
-            # Base query - use the <-> operator for cosine distance
+            # Base query - use the <=> operator for cosine distance
             query = select(
                 KnowledgeDocument,
-                KnowledgeDocument.embedding.cosine_distance(query_embedding).label('distance')
+                KnowledgeDocument.embedding.cosine_distance(query_vector).label('distance')
             ).where(
                 and_(
                     KnowledgeDocument.agent_id == agent_id,
@@ -3,23 +3,25 @@ Production-grade RAG engine with advanced features
 """
 import os
 import asyncio
+import functools
 import uuid
 import hashlib
-from typing import List, Dict, Any, Optional, Tuple
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+from datetime import datetime, timedelta
 import logging
 import json
 from pathlib import Path
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, insert, and_, func
 import redis.asyncio as redis
 
 from config import settings
 from models import ChatMessage, ChatResponse
-from database import KnowledgeDocument, Agent, async_session, get_db
-from llm_providers import LLMProviderFactory, LLMProviderWithFallback
-from embedding_providers import EmbeddingProviderFactory, CachedEmbeddingProvider
+from database import KnowledgeDocument, Agent, Conversation, Message, async_session
+from llm_providers import LLMProviderFactory, get_llm_provider
+from llm_cache import PrefixCache, response_scope
+from embedding_providers import EmbeddingProviderFactory, CachedEmbeddingProvider, normalize_for_storage
 
 from .chunking_strategies import get_chunker, ChunkMetadata
 from .document_parsers import parse_document, ParsedDocument
@@ -28,6 +30,17 @@ from rich_content_generator import RichContentGenerator
 
 logger = logging.getLogger(__name__)
 
+# Ingestion pipeline: chunks per embedding call and batches buffered between stages
+INGEST_BATCH_SIZE = 32
+INGEST_QUEUE_SIZE = 2
+
+# Speculative query-embedding prefetch: how many recent queries, from how far back,
+# and how often per agent. One prefetch runs at a time so it never floods the API.
+PREFETCH_QUERY_LIMIT = 20
+PREFETCH_LOOKBACK = timedelta(days=7)
+PREFETCH_INTERVAL = timedelta(minutes=10)
+_prefetch_semaphore = asyncio.Semaphore(1)
+
 
 class DocumentIngestionResult:
     """Result of document ingestion"""
@@ -68,8 +81,11 @@ class ProductionRAGEngine:
             except Exception as e:
                 logger.warning(f"Failed to initialize Redis: {e}")
         
+        # Rendered system prompts per agent
+        self.prefix_cache = PrefixCache(self.redis_client) if self.redis_client else None
+        
         # Initialize LLM provider with fallback
-        self.llm_provider = LLMProviderWithFallback()
+        self.llm_provider = get_llm_provider()
         
         # Initialize embedding provider with caching
         embedding_provider = EmbeddingProviderFactory.create_provider()
@@ -97,6 +113,10 @@ class ProductionRAGEngine:
         self.chunk_overlap = settings.CHUNK_OVERLAP
         self.top_k = settings.TOP_K_RETRIEVAL
         
+        # Speculative prefetch bookkeeping
+        self._prefetched_at: Dict[str, datetime] = {}
+        self._prefetch_tasks = set()
+        
         logger.info("Production RAG Engine initialized")
     
     async def ingest_document(self,
@@ -120,33 +140,17 @@ class ProductionRAGEngine:
         result = DocumentIngestionResult()
         
         try:
-            # Parse document
+            # Parse and chunk off the event loop; both are CPU-bound
             logger.info(f"Parsing document: {file_path or 'raw content'}")
-            parsed_doc = parse_document(file_path, file_content)
-            result.total_documents = 1
-            
-            # Determine content type for chunking
-            content_type = self._determine_content_type(parsed_doc, file_path)
-            
-            # Get appropriate chunker
-            chunker = get_chunker(
-                content_type=content_type,
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap
+            parsed_doc, chunks = await asyncio.to_thread(
+                self._parse_and_chunk, file_path, file_content
             )
-            
-            # Chunk the document
-            chunks = chunker.chunk(parsed_doc.content, parsed_doc.metadata)
+            result.total_documents = 1
             result.total_chunks = len(chunks)
             logger.info(f"Created {len(chunks)} chunks from document")
             
-            # Process chunks in batches
-            batch_size = 10
-            for i in range(0, len(chunks), batch_size):
-                batch = chunks[i:i + batch_size]
-                await self._process_chunk_batch(
-                    batch, agent_id, parsed_doc, metadata, result
-                )
+            # Embed batch k while batch k-1 is written and batch k+1 is queued
+            await self._run_ingest_pipeline(chunks, agent_id, parsed_doc, metadata, result)
             
             # Store document metadata
             if self.redis_client and agent_id:
@@ -161,69 +165,128 @@ class ProductionRAGEngine:
         result.processing_time = (datetime.now() - start_time).total_seconds()
         return result
     
-    async def _process_chunk_batch(self,
+    def _parse_and_chunk(self,
+                         file_path: Optional[str],
+                         file_content: Optional[bytes]) -> Tuple[ParsedDocument, List[Tuple[str, ChunkMetadata]]]:
+        """Parse a document and split it with the chunker for its content type"""
+        parsed_doc = parse_document(file_path, file_content)
+        
+        # Determine content type for chunking
+        content_type = self._determine_content_type(parsed_doc, file_path)
+        
+        # Get appropriate chunker
+        chunker = get_chunker(
+            content_type=content_type,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap
+        )
+        
+        return parsed_doc, chunker.chunk(parsed_doc.content, parsed_doc.metadata)
+    
+    async def _run_ingest_pipeline(self,
+                                   chunks: List[Tuple[str, ChunkMetadata]],
+                                   agent_id: str,
+                                   parsed_doc: ParsedDocument,
+                                   metadata: Optional[Dict[str, Any]],
+                                   result: DocumentIngestionResult):
+        """Run batching, embedding and database writes as concurrent stages"""
+        # Bounded queues keep at most a couple of batches in flight per stage
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        write_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        
+        async def produce():
+            for i in range(0, len(chunks), INGEST_BATCH_SIZE):
+                await embed_queue.put(chunks[i:i + INGEST_BATCH_SIZE])
+            await embed_queue.put(None)
+        
+        async def embed():
+            while (batch := await embed_queue.get()) is not None:
+                try:
+                    embeddings = await self.embedding_provider.embed_texts(
+                        [chunk_text for chunk_text, _ in batch]
+                    )
+                except Exception as e:
+                    logger.error(f"Error embedding chunk batch: {e}")
+                    result.failed_chunks += len(batch)
+                    result.errors.append(f"Batch processing error: {str(e)}")
+                    continue
+                await write_queue.put((batch, embeddings))
+            await write_queue.put(None)
+        
+        async def write():
+            # One transaction for the whole document, committed once at the end
+            async with async_session() as db:
+                written = []
+                while (item := await write_queue.get()) is not None:
+                    written += await self._write_chunk_batch(
+                        db, *item, agent_id, parsed_doc, metadata, result
+                    )
+                
+                try:
+                    await db.commit()
+                except Exception as e:
+                    logger.error(f"Error committing document chunks: {e}")
+                    result.failed_chunks += len(written)
+                    result.errors.append(f"Commit error: {str(e)}")
+                    return
+                
+                result.document_ids.extend(written)
+                result.successful_chunks += len(written)
+        
+        await asyncio.gather(produce(), embed(), write())
+    
+    async def _write_chunk_batch(self,
+                                 db: AsyncSession,
                                  chunks: List[Tuple[str, ChunkMetadata]],
+                                 embeddings: List[List[float]],
                                  agent_id: str,
                                  parsed_doc: ParsedDocument,
                                  metadata: Optional[Dict[str, Any]],
-                                 result: DocumentIngestionResult):
-        """Process a batch of chunks"""
-        # Extract texts for embedding
-        texts = [chunk_text for chunk_text, _ in chunks]
-        
+                                 result: DocumentIngestionResult) -> List[str]:
+        """Insert a batch of embedded chunks with one multi-row INSERT, returning their ids"""
         try:
-            # Generate embeddings for batch
-            embeddings = await self.embedding_provider.embed_texts(texts)
-            
-            # Create documents
-            async for db in get_db():
-                for i, ((chunk_text, chunk_meta), embedding) in enumerate(zip(chunks, embeddings)):
-                    try:
-                        # Create document metadata
-                        doc_metadata = {
-                            'chunk_metadata': {
-                                'chunk_id': chunk_meta.chunk_id,
-                                'chunk_index': chunk_meta.chunk_index,
-                                'total_chunks': result.total_chunks,
-                                'start_char': chunk_meta.start_char,
-                                'end_char': chunk_meta.end_char,
-                                'word_count': chunk_meta.word_count,
-                                'token_count': chunk_meta.token_count,
-                                'has_code': chunk_meta.has_code,
-                                'section_title': chunk_meta.section_title,
-                                'page_number': chunk_meta.page_number
-                            },
-                            'document_metadata': parsed_doc.metadata,
-                            'custom_metadata': metadata or {}
-                        }
-                        
-                        # Create knowledge document
-                        doc = KnowledgeDocument(
-                            id=str(uuid.uuid4()),
-                            agent_id=agent_id,
-                            title=doc_metadata.get('document_metadata', {}).get('title', f'Chunk {chunk_meta.chunk_index}'),
-                            content=chunk_text,
-                            url=doc_metadata.get('custom_metadata', {}).get('url'),
-                            embedding=embedding,
-                            meta_data=doc_metadata
-                        )
-                        
-                        db.add(doc)
-                        result.document_ids.append(doc.id)
-                        result.successful_chunks += 1
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing chunk {i}: {e}")
-                        result.failed_chunks += 1
-                        result.errors.append(f"Chunk {i}: {str(e)}")
-                
-                await db.commit()
-                break
+            rows = []
+            for (chunk_text, chunk_meta), embedding in zip(chunks, embeddings):
+                # Create document metadata
+                doc_metadata = {
+                    'chunk_metadata': {
+                        'chunk_id': chunk_meta.chunk_id,
+                        'chunk_index': chunk_meta.chunk_index,
+                        'total_chunks': result.total_chunks,
+                        'start_char': chunk_meta.start_char,
+                        'end_char': chunk_meta.end_char,
+                        'word_count': chunk_meta.word_count,
+                        'token_count': chunk_meta.token_count,
+                        'has_code': chunk_meta.has_code,
+                        'section_title': chunk_meta.section_title,
+                        'page_number': chunk_meta.page_number
+                    },
+                    'document_metadata': parsed_doc.metadata,
+                    'custom_metadata': metadata or {}
+                }
                 
+                rows.append({
+                    'id': str(uuid.uuid4()),
+                    'agent_id': agent_id,
+                    'title': doc_metadata.get('document_metadata', {}).get('title', f'Chunk {chunk_meta.chunk_index}'),
+                    'content': chunk_text,
+                    'url': doc_metadata.get('custom_metadata', {}).get('url'),
+                    'embedding': normalize_for_storage(embedding),
+                    'meta_data': doc_metadata,
+                    'created_at': datetime.utcnow(),
+                    'updated_at': datetime.utcnow()
+                })
+            
+            # Savepoint so a failed batch doesn't abort the document's transaction
+            async with db.begin_nested():
+                await db.execute(insert(KnowledgeDocument), rows)
         except Exception as e:
-            logger.error(f"Error processing chunk batch: {e}")
+            logger.error(f"Error writing chunk batch: {e}")
             result.failed_chunks += len(chunks)
             result.errors.append(f"Batch processing error: {str(e)}")
+            return []
+        
+        return [row['id'] for row in rows]
     
     def _determine_content_type(self, 
                               parsed_doc: ParsedDocument,
@@ -272,6 +335,47 @@ class ProductionRAGEngine:
         except Exception as e:
             logger.warning(f"Failed to store document metadata: {e}")
     
+    def schedule_query_prefetch(self, agent_id: str):
+        """Warm the embedding cache for an agent's frequent queries in the background"""
+        if not isinstance(self.embedding_provider, CachedEmbeddingProvider):
+            return
+        
+        now = datetime.utcnow()
+        last = self._prefetched_at.get(agent_id)
+        if last and now - last < PREFETCH_INTERVAL:
+            return
+        self._prefetched_at[agent_id] = now
+        
+        # Hold a reference so the fire-and-forget task is not garbage collected
+        task = asyncio.create_task(self._prefetch_query_embeddings(agent_id))
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+    
+    async def _prefetch_query_embeddings(self, agent_id: str):
+        """Embed the agent's most frequent recent visitor messages into the cache"""
+        try:
+            async with _prefetch_semaphore:
+                async with async_session() as db:
+                    result = await db.execute(
+                        select(Message.content)
+                        .join(Conversation, Message.conversation_id == Conversation.id)
+                        .where(
+                            Conversation.agent_id == agent_id,
+                            Conversation.started_at >= datetime.utcnow() - PREFETCH_LOOKBACK,
+                            Message.sender == 'user'
+                        )
+                        .group_by(Message.content)
+                        .order_by(func.count().desc())
+                        .limit(PREFETCH_QUERY_LIMIT)
+                    )
+                    queries = list(result.scalars())
+                
+                if queries:
+                    await self.embedding_provider.embed_texts(queries)
+                    logger.debug(f"Prefetched {len(queries)} query embeddings for agent {agent_id}")
+        except Exception as e:
+            logger.warning(f"Query embedding prefetch failed for agent {agent_id}: {e}")
+    
     async def search(self,
                    query: str,
                    agent_id: str,
@@ -298,7 +402,7 @@ class ProductionRAGEngine:
             query_embedding = await self.embedding_provider.embed_text(query)
             
             # Perform hybrid search
-            async for db in get_db():
+            async with async_session() as db:
                 results = await self.search_engine.search(
                     query=query,
                     query_embedding=query_embedding,
@@ -308,7 +412,6 @@ class ProductionRAGEngine:
                     db=db,
                     filters=filters
                 )
-                break
             
             # Apply re-ranking if enabled
             if use_reranking and results:
@@ -324,7 +427,8 @@ class ProductionRAGEngine:
                               message: ChatMessage,
                               agent_id: str,
                               conversation_history: Optional[List[Dict[str, str]]] = None,
-                              max_context_length: int = 3000) -> ChatResponse:
+                              max_context_length: int = 3000,
+                              on_token: Optional[Callable[[str], Awaitable[None]]] = None) -> ChatResponse:
         """
         Generate response using RAG
         
@@ -333,6 +437,7 @@ class ProductionRAGEngine:
             agent_id: Agent ID
             conversation_history: Previous conversation messages
             max_context_length: Maximum context length in tokens
+            on_token: If given, the answer is streamed and each text chunk is passed to it
         
         Returns:
             ChatResponse with generated answer
@@ -348,19 +453,32 @@ class ProductionRAGEngine:
             # Build context from search results
             context = self._build_context(search_results, max_context_length)
             
-            # Get agent configuration
-            agent_config = await self._get_agent_config(agent_id)
+            # Get the agent's system prompt
+            system_prompt = await self._get_system_prompt(agent_id)
             
             # Build prompt
             prompt = self._build_prompt(
                 query=message.content,
                 context=context,
                 conversation_history=conversation_history,
-                agent_config=agent_config
+                system_prompt=system_prompt
             )
             
             # Generate response
-            response_text = await self.llm_provider.complete(prompt)
+            completion_options = {
+                'cache_scope': self._response_scope(agent_id, context, conversation_history, system_prompt),
+                'query_embedding': await self._cached_query_embedding(message.content)
+            }
+            if settings.LLM_TEMPERATURE is not None:
+                completion_options['temperature'] = settings.LLM_TEMPERATURE
+            if on_token is None:
+                response_text = await self.llm_provider.complete(prompt, **completion_options)
+            else:
+                chunks = []
+                async for chunk in self.llm_provider.stream_complete(prompt, **completion_options):
+                    chunks.append(chunk)
+                    await on_token(chunk)
+                response_text = "".join(chunks)
             
             # Generate rich content if appropriate
             try:
@@ -467,7 +585,7 @@ class ProductionRAGEngine:
     async def _get_agent_config(self, agent_id: str) -> Dict[str, Any]:
         """Get agent configuration"""
         try:
-            async for db in get_db():
+            async with async_session() as db:
                 result = await db.execute(
                     select(Agent).where(Agent.id == agent_id)
                 )
@@ -481,7 +599,6 @@ class ProductionRAGEngine:
                         'instructions': getattr(agent, 'instructions', ''),
                         'capabilities': getattr(agent, 'capabilities', [])
                     }
-                break
         except Exception as e:
             logger.warning(f"Failed to get agent config: {e}")
         
@@ -494,14 +611,21 @@ class ProductionRAGEngine:
             'capabilities': []
         }
     
-    def _build_prompt(self,
-                     query: str,
-                     context: str,
-                     conversation_history: Optional[List[Dict[str, str]]],
-                     agent_config: Dict[str, Any]) -> str:
-        """Build prompt for LLM"""
-        # Base system prompt
-        system_prompt = f"""You are {agent_config['name']}, an AI assistant with the following characteristics:
+    async def _get_system_prompt(self, agent_id: str) -> str:
+        """Get the agent's rendered system prompt, from the prefix cache when possible"""
+        if self.prefix_cache:
+            cached = await self.prefix_cache.get(agent_id)
+            if cached is not None:
+                return cached
+        
+        system_prompt = self._build_system_prompt(await self._get_agent_config(agent_id))
+        if self.prefix_cache:
+            await self.prefix_cache.set(agent_id, system_prompt)
+        return system_prompt
+    
+    def _build_system_prompt(self, agent_config: Dict[str, Any]) -> str:
+        """Base system prompt for an agent"""
+        return f"""You are {agent_config['name']}, an AI assistant with the following characteristics:
 Description: {agent_config.get('description', 'A helpful AI assistant')}
 Personality: {json.dumps(agent_config.get('personality', {'tone': 'professional'}))}
 
@@ -510,7 +634,35 @@ Instructions:
 
 Your task is to answer questions based on the provided context and your knowledge. 
 Always cite your sources when using information from the context by referencing the source number [1], [2], etc."""
-
+    
+    def _response_scope(self,
+                        agent_id: str,
+                        context: str,
+                        conversation_history: Optional[List[Dict[str, str]]],
+                        system_prompt: str) -> str:
+        """Response cache scope covering every part of the prompt but the question"""
+        history = [
+            (msg.get('role', 'user'), msg.get('content', ''))
+            for msg in (conversation_history or [])[-5:]
+        ]
+        return response_scope(agent_id, system_prompt, context, json.dumps(history))
+    
+    async def _cached_query_embedding(self, query: str) -> Optional[List[float]]:
+        """The query's embedding from search(), when the embedding cache still holds it"""
+        if not isinstance(self.embedding_provider, CachedEmbeddingProvider):
+            return None
+        try:
+            return await self.embedding_provider.embed_text(query)
+        except Exception as e:
+            logger.debug(f"No query embedding for the response cache: {e}")
+            return None
+    
+    def _build_prompt(self,
+                     query: str,
+                     context: str,
+                     conversation_history: Optional[List[Dict[str, str]]],
+                     system_prompt: str) -> str:
+        """Build prompt for LLM"""
         # Add conversation history if available
         history_text = ""
         if conversation_history:
@@ -621,7 +773,7 @@ Please provide a helpful response. Note that I don't have specific context infor
         start_time = datetime.now()
         
         try:
-            async for db in get_db():
+            async with async_session() as db:
                 # Find documents without embeddings
                 result = await db.execute(
                     select(KnowledgeDocument).where(
@@ -645,7 +797,7 @@ Please provide a helpful response. Note that I don't have specific context infor
                         
                         # Update documents
                         for doc, embedding in zip(batch, embeddings):
-                            doc.embedding = embedding
+                            doc.embedding = normalize_for_storage(embedding)
                             stats['updated_documents'] += 1
                         
                         await db.commit()
@@ -655,10 +807,15 @@ Please provide a helpful response. Note that I don't have specific context infor
                         stats['failed_documents'] += len(batch)
                         await db.rollback()
                 
-                break
                 
         except Exception as e:
             logger.error(f"Error updating embeddings: {e}")
         
         stats['processing_time'] = (datetime.now() - start_time).total_seconds()
-        return stats
\ No newline at end of file
+        return stats
+
+
+@functools.lru_cache(maxsize=None)
+def get_rag_engine() -> ProductionRAGEngine:
+    """Process-wide RAG engine, built on first use"""
+    return ProductionRAGEngine()
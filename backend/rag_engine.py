@@ -20,7 +20,7 @@ from langchain.embeddings.base import Embeddings
 
 from config import settings
 from models import ChatMessage, ChatResponse, KnowledgeDocument
-from llm_providers import LLMProviderFactory, LLMProviderWithFallback
+from llm_providers import LLMProviderFactory, get_llm_provider
 from embedding_providers import EmbeddingProviderFactory, CachedEmbeddingProvider
 from vector_store import PgVectorStore
 
@@ -181,7 +181,7 @@ class RAGEngine:
                 logger.warning(f"Failed to initialize Redis: {e}")
         
         # Initialize LLM provider with fallback
-        self.llm_provider = LLMProviderWithFallback()
+        self.llm_provider = get_llm_provider()
         self.llm = LangChainLLM(llm=CustomLLM(self.llm_provider))
         
         # Initialize embedding provider with caching
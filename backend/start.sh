@@ -23,4 +23,4 @@ python -c "import asyncio; from database import init_db; asyncio.run(init_db())"
 
 # Start the application
 echo "Starting uvicorn server..."
-exec uvicorn main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools
\ No newline at end of file
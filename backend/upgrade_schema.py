@@ -0,0 +1,162 @@
+"""
+Script to bring an existing database up to the current schema.
+
+init_db() only creates missing tables, so columns and indexes added to the
+models after a database was created are applied here. Every statement is
+idempotent and the script can be re-run safely.
+"""
+import asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from config import settings
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (table, column, referenced table) for foreign keys rebuilt around the uuid conversion
+UUID_FOREIGN_KEYS = [
+    ("api_keys", "user_id", "users (id)"),
+    ("agents", "user_id", "users (id)"),
+    ("conversations", "agent_id", "agents (id)"),
+    ("messages", "conversation_id", "conversations (id)"),
+    ("subscriptions", "user_id", "users (id)"),
+    ("usage_records", "user_id", "users (id)"),
+    ("payments", "user_id", "users (id)"),
+]
+LEAD_UUID_FOREIGN_KEYS = [
+    ("leads", "agent_id", "agents (id)"),
+    ("leads", "conversation_id", "conversations (id)"),
+    ("handoff_requests", "agent_id", "agents (id)"),
+    ("handoff_requests", "conversation_id", "conversations (id)"),
+    ("lead_forms", "agent_id", "agents (id)"),
+]
+
+# Column additions and data backfills, applied in order
+SCHEMA_CHANGES = [
+    # gen_random_uuid() is built in from PostgreSQL 13; pgcrypto provides it before that
+    "CREATE EXTENSION IF NOT EXISTS pgcrypto",
+    # Native uuid id columns. Foreign keys between the converted columns are
+    # dropped first and re-added once both sides are uuid; the lead tables'
+    # keys to agents and conversations are restored with the lead conversion below
+    *(
+        f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}_fkey"
+        for table, column, _ in UUID_FOREIGN_KEYS + LEAD_UUID_FOREIGN_KEYS
+    ),
+    "ALTER TABLE users ALTER COLUMN id TYPE uuid USING id::uuid",
+    "ALTER TABLE api_keys ALTER COLUMN id TYPE uuid USING id::uuid, "
+    "ALTER COLUMN user_id TYPE uuid USING user_id::uuid",
+    "ALTER TABLE agents ALTER COLUMN id TYPE uuid USING id::uuid, "
+    "ALTER COLUMN user_id TYPE uuid USING user_id::uuid",
+    "ALTER TABLE conversations ALTER COLUMN id TYPE uuid USING id::uuid, "
+    "ALTER COLUMN agent_id TYPE uuid USING agent_id::uuid, "
+    "ALTER COLUMN lead_id TYPE uuid USING NULLIF(lead_id, '')::uuid",
+    "ALTER TABLE messages ALTER COLUMN conversation_id TYPE uuid USING conversation_id::uuid",
+    "ALTER TABLE knowledge_documents ALTER COLUMN agent_id TYPE uuid USING agent_id::uuid",
+    "ALTER TABLE subscriptions ALTER COLUMN user_id TYPE uuid USING user_id::uuid",
+    "ALTER TABLE usage_records ALTER COLUMN user_id TYPE uuid USING user_id::uuid",
+    "ALTER TABLE payments ALTER COLUMN user_id TYPE uuid USING user_id::uuid",
+    *(
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey "
+        f"FOREIGN KEY ({column}) REFERENCES {target}"
+        for table, column, target in UUID_FOREIGN_KEYS
+    ),
+    # Typed conversation fields promoted out of meta_data
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS source VARCHAR",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS test_user BOOLEAN DEFAULT FALSE",
+    "UPDATE conversations SET source = meta_data->>'source', "
+    "test_user = COALESCE((meta_data->>'test_user')::boolean, FALSE) "
+    "WHERE source IS NULL AND meta_data->>'source' IS NOT NULL",
+    # LZ4 TOAST compression for long message content (PostgreSQL 14+, applies to new rows)
+    "DO $$ BEGIN "
+    "IF current_setting('server_version_num')::int >= 140000 THEN "
+    "ALTER TABLE messages ALTER COLUMN content SET COMPRESSION lz4; "
+    "END IF; "
+    "EXCEPTION WHEN feature_not_supported THEN NULL; "
+    "END $$",
+    # FP16 embeddings (pgvector 0.7+); cosine distance is unaffected by the
+    # normalization new rows get, so existing vectors are converted as-is
+    "ALTER TABLE knowledge_documents ALTER COLUMN embedding TYPE halfvec USING embedding::halfvec",
+    # Lead and lead form JSON stored as pre-parsed, indexable JSONB
+    "ALTER TABLE leads ALTER COLUMN custom_fields TYPE jsonb USING custom_fields::jsonb",
+    "ALTER TABLE leads ALTER COLUMN tags TYPE jsonb USING tags::jsonb",
+    "ALTER TABLE lead_forms ALTER COLUMN fields TYPE jsonb USING fields::jsonb",
+    "ALTER TABLE lead_forms ALTER COLUMN trigger_conditions TYPE jsonb USING trigger_conditions::jsonb",
+    "ALTER TABLE lead_forms ALTER COLUMN custom_styles TYPE jsonb USING custom_styles::jsonb",
+    # Native, server-generated UUID keys for lead tables; the handoff -> lead
+    # foreign key is dropped and re-added around the type change, along with
+    # the agent and conversation keys dropped by the core conversion above
+    "ALTER TABLE handoff_requests DROP CONSTRAINT IF EXISTS handoff_requests_lead_id_fkey",
+    "ALTER TABLE leads ALTER COLUMN id TYPE uuid USING id::uuid, "
+    "ALTER COLUMN id SET DEFAULT gen_random_uuid(), "
+    "ALTER COLUMN agent_id TYPE uuid USING agent_id::uuid, "
+    "ALTER COLUMN conversation_id TYPE uuid USING conversation_id::uuid",
+    "ALTER TABLE handoff_requests ALTER COLUMN id TYPE uuid USING id::uuid, "
+    "ALTER COLUMN id SET DEFAULT gen_random_uuid(), "
+    "ALTER COLUMN lead_id TYPE uuid USING lead_id::uuid, "
+    "ALTER COLUMN agent_id TYPE uuid USING agent_id::uuid, "
+    "ALTER COLUMN conversation_id TYPE uuid USING conversation_id::uuid",
+    "ALTER TABLE lead_forms ALTER COLUMN id TYPE uuid USING id::uuid, "
+    "ALTER COLUMN id SET DEFAULT gen_random_uuid(), "
+    "ALTER COLUMN agent_id TYPE uuid USING agent_id::uuid",
+    "ALTER TABLE handoff_requests ADD CONSTRAINT handoff_requests_lead_id_fkey "
+    "FOREIGN KEY (lead_id) REFERENCES leads (id)",
+    *(
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey "
+        f"FOREIGN KEY ({column}) REFERENCES {target}"
+        for table, column, target in LEAD_UUID_FOREIGN_KEYS
+    ),
+    # Sortable handoff priority
+    "ALTER TABLE handoff_requests ADD COLUMN IF NOT EXISTS priority_rank SMALLINT",
+    "UPDATE handoff_requests SET priority_rank = CASE priority "
+    "WHEN 'low' THEN 1 WHEN 'high' THEN 3 WHEN 'urgent' THEN 4 ELSE 2 END "
+    "WHERE priority_rank IS NULL",
+]
+
+INDEXES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conversations_agent_started "
+    "ON conversations (agent_id, started_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_conv_ts "
+    "ON messages (conversation_id, timestamp)",
+    # Matches the GROUP BY key of the knowledge document listing
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_knowledge_documents_agent_filename "
+    "ON knowledge_documents (agent_id, (COALESCE(meta_data -> 'custom_metadata' ->> 'original_filename', title)))",
+    # Backs the ON CONFLICT (email, agent_id) upsert in create_lead; remove
+    # duplicate leads first or this fails and leaves an invalid index
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_leads_email_agent "
+    "ON leads (email, agent_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_leads_agent_created "
+    "ON leads (agent_id, created_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_leads_agent_status_created "
+    "ON leads (agent_id, status, created_at)",
+    # Leading column of uq_leads_email_agent, so the single-column index is redundant
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_leads_email",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_leads_tags_gin "
+    "ON leads USING gin (tags)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_handoff_agent_status_priority "
+    "ON handoff_requests (agent_id, status, priority_rank DESC, created_at)",
+]
+
+async def upgrade_schema():
+    """Apply missing columns, then create missing indexes without locking writes"""
+    
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    engine = create_async_engine(
+        settings.DATABASE_URL, echo=True, isolation_level="AUTOCOMMIT"
+    )
+    
+    try:
+        async with engine.connect() as conn:
+            for statement in SCHEMA_CHANGES + INDEXES:
+                await conn.execute(text(statement))
+        
+        logger.info("Schema upgraded successfully!")
+        
+    except Exception as e:
+        logger.error(f"Error upgrading schema: {e}")
+        raise
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(upgrade_schema())
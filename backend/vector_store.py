@@ -13,8 +13,8 @@ from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from pgvector.sqlalchemy import Vector
 
-from database import KnowledgeDocument, get_session
-from embedding_providers import BaseEmbeddingProvider
+from database import KnowledgeDocument, async_session
+from embedding_providers import BaseEmbeddingProvider, normalize_for_storage
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +33,7 @@ class PgVectorStore:
         """Add documents with embeddings to the database"""
         document_ids = []
         
-        async for session in get_session():
+        async with async_session() as session:
             try:
                 for doc in documents:
                     # Generate embedding
@@ -48,7 +48,7 @@ class PgVectorStore:
                         content=doc['content'],
                         url=doc.get('url'),
                         meta_data=doc.get('metadata', {}),
-                        embedding=embedding
+                        embedding=normalize_for_storage(embedding)
                     )
                     
                     session.add(knowledge_doc)
@@ -76,7 +76,7 @@ class PgVectorStore:
         # Generate query embedding
         query_embedding = await self.embedding_provider.embed_text(query)
         
-        async for session in get_session():
+        async with async_session() as session:
             try:
                 # Use pgvector's cosine distance operator (<=>)
                 # Note: pgvector returns distance, not similarity, so we need to convert
@@ -87,10 +87,10 @@ class PgVectorStore:
                     SELECT 
                         id, agent_id, title, content, url, meta_data, 
                         created_at, updated_at,
-                        1 - (embedding <=> :query_embedding ::vector) as similarity
+                        1 - (embedding <=> :query_embedding ::halfvec) as similarity
                     FROM knowledge_documents
                     WHERE agent_id = :agent_id
-                        AND 1 - (embedding <=> :query_embedding ::vector) > :threshold
+                        AND 1 - (embedding <=> :query_embedding ::halfvec) > :threshold
                     ORDER BY similarity DESC
                     LIMIT :k
                 """)
@@ -129,7 +129,7 @@ class PgVectorStore:
     
     async def get_all_documents(self, agent_id: str) -> List[KnowledgeDocument]:
         """Get all documents for an agent"""
-        async for session in get_session():
+        async with async_session() as session:
             try:
                 stmt = select(KnowledgeDocument).where(
                     KnowledgeDocument.agent_id == agent_id
@@ -143,7 +143,7 @@ class PgVectorStore:
     
     async def delete_document(self, document_id: str) -> bool:
         """Delete a document by ID"""
-        async for session in get_session():
+        async with async_session() as session:
             try:
                 stmt = select(KnowledgeDocument).where(
                     KnowledgeDocument.id == document_id
@@ -167,7 +167,7 @@ class PgVectorStore:
     
     async def clear_agent_documents(self, agent_id: str) -> int:
         """Clear all documents for an agent"""
-        async for session in get_session():
+        async with async_session() as session:
             try:
                 stmt = select(KnowledgeDocument).where(
                     KnowledgeDocument.agent_id == agent_id